@@ -23,18 +23,39 @@ class HttpRelayService : Service() {
     // --- CONFIGURATION ---
     // Cloud server base URL (Render). Example: "https://rc-remote-control-server.onrender.com"
     private val SERVER_URL = "https://rc-remote-control-server.onrender.com"
+    // Vehicle this relay serves; empty uses the server's default vehicle
+    private val VEHICLE_ID = ""
     private val ESP32_PORT = 4210
     // --- END CONFIGURATION ---
 
+    private val apiBase get() = if (VEHICLE_ID.isEmpty()) SERVER_URL else "$SERVER_URL/v/$VEHICLE_ID"
+
     private lateinit var wakeLock: PowerManager.WakeLock
     private val isRunning = AtomicBoolean(false)
     private var networkingThread: Thread? = null
     private var httpServerThread: Thread? = null
     private var serverSocket: ServerSocket? = null
     @Volatile private var esp32IpForRelay: String = "0.0.0.0"
+    private var lastKeepAlive = 0L
+    private var lastStreamEventId: String? = null
+    private var lastControlsEtag: String? = null
+    private var lastControlsJson = ""
+    private var lastControlsVersion: String? = null
+    private var lastFrameReport = 0L
+    // Commands already sent to the ESP32 (the server repeats them until acked) and acks still owed
+    // IDs are "<server boot id>-<n>", so ones remembered across a server restart never collide
+    private val forwardedCommandIds = LinkedHashSet<String>()
+    private val pendingAcks = mutableListOf<String>()
 
     companion object {
         const val NOTIFICATION_CHANNEL_ID = "HttpRelayServiceChannel"
+        const val KEEP_ALIVE_TIMEOUT_MS = 30000
+        const val KEEP_ALIVE_INTERVAL_MS = 15000L
+        const val POLL_INTERVAL_MS = 33L // ~30 Hz fallback when streaming is unavailable
+        const val STREAM_READ_TIMEOUT_MS = 10000 // several server heartbeats
+        const val STREAM_RETRY_MS = 10000L
+        const val FRAME_REPORT_INTERVAL_MS = 1000L // how often to report frame timing for /metrics
+        const val MAX_REMEMBERED_COMMANDS = 256
     }
 
     override fun onStartCommand(intent: Intent?, flags: Int, startId: Int): Int {
@@ -113,12 +134,15 @@ class HttpRelayService : Service() {
 
     private fun handleHttpRequest(clientSocket: Socket) {
         try {
+            // The server keeps its connection open between pushes; drop it if it goes quiet
+            clientSocket.soTimeout = KEEP_ALIVE_TIMEOUT_MS
             val input = BufferedReader(InputStreamReader(clientSocket.getInputStream()))
             val output = clientSocket.getOutputStream()
             
-            // Read HTTP request
-            val requestLine = input.readLine()
-            if (requestLine != null) {
+            // Serve requests on this connection until the peer closes it
+            while (isRunning.get()) {
+                val requestLine = input.readLine() ?: break
+                if (requestLine.isEmpty()) continue
                 val parts = requestLine.split(" ")
                 val method = parts[0]
                 val path = parts[1]
@@ -127,37 +151,56 @@ class HttpRelayService : Service() {
                 
                 // Read headers
                 var contentLength = 0
+                var closeRequested = parts.getOrNull(2) == "HTTP/1.0"
                 var line: String?
                 while (input.readLine().also { line = it } != null && line != "") {
-                    if (line?.startsWith("Content-Length: ") == true) {
-                        contentLength = line?.substring(16)?.toIntOrNull() ?: 0
+                    val header = line ?: break
+                    if (header.startsWith("Content-Length:", ignoreCase = true)) {
+                        contentLength = header.substringAfter(":").trim().toIntOrNull() ?: 0
+                    } else if (header.startsWith("Connection:", ignoreCase = true)) {
+                        closeRequested = header.substringAfter(":").trim().equals("close", ignoreCase = true)
                     }
                 }
                 
                 // Read body if present
                 val body = if (contentLength > 0) {
                     val bodyChars = CharArray(contentLength)
-                    input.read(bodyChars, 0, contentLength)
-                    String(bodyChars)
+                    var read = 0
+                    while (read < contentLength) {
+                        val n = input.read(bodyChars, read, contentLength - read)
+                        if (n < 0) break
+                        read += n
+                    }
+                    String(bodyChars, 0, read)
                 } else ""
                 
                 // Handle different endpoints
                 val response = when {
                     path.startsWith("/rc_controls") -> handleRcControls(body)
                     path.startsWith("/command") -> handleCommand(body)
-                    else -> "HTTP/1.1 404 Not Found\r\n\r\nNot found"
+                    else -> httpResponse("404 Not Found", "text/plain", "Not found", closeRequested)
                 }
                 
                 output.write(response.toByteArray())
+                output.flush()
+                if (closeRequested) break
             }
             
             clientSocket.close()
             
+        } catch (e: java.net.SocketTimeoutException) {
+            try { clientSocket.close() } catch (_: Exception) {}
         } catch (e: Exception) {
             android.util.Log.e("HttpRelayService", "Error handling HTTP request: ${e.message}", e)
+            try { clientSocket.close() } catch (_: Exception) {}
         }
     }
 
+    private fun httpResponse(status: String, contentType: String, body: String, close: Boolean = false): String {
+        val connection = if (close) "close" else "keep-alive"
+        return "HTTP/1.1 $status\r\nContent-Type: $contentType\r\nContent-Length: ${body.toByteArray().size}\r\nConnection: $connection\r\n\r\n$body"
+    }
+
     private fun handleRcControls(body: String): String {
         try {
             // Parse rc_controls parameter
@@ -176,7 +219,7 @@ class HttpRelayService : Service() {
             android.util.Log.e("HttpRelayService", "Error handling RC controls: ${e.message}", e)
         }
         
-        return "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{\"status\":\"ok\"}"
+        return httpResponse("200 OK", "application/json", "{\"status\":\"ok\"}")
     }
 
     private fun handleCommand(body: String): String {
@@ -197,7 +240,7 @@ class HttpRelayService : Service() {
             android.util.Log.e("HttpRelayService", "Error handling command: ${e.message}", e)
         }
         
-        return "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{\"status\":\"ok\"}"
+        return httpResponse("200 OK", "application/json", "{\"status\":\"ok\"}")
     }
 
     private fun forwardToEsp32(message: String) {
@@ -218,7 +261,7 @@ class HttpRelayService : Service() {
             android.util.Log.d("HttpRelayService", "Starting HTTP relay logic...")
             
             // Send initial keep-alive to server
-            sendKeepAlive()
+            sendKeepAliveIfDue()
             
             sendStatus("Running")
             updateNotification("HTTP RC Relay is active.")
@@ -227,30 +270,36 @@ class HttpRelayService : Service() {
             val udpSocket = java.net.DatagramSocket()
             val espAddr = java.net.InetAddress.getByName(esp32Ip)
 
-            var lastKeepAlive = 0L
-            val keepAliveIntervalMs = 15000L
-            val pollIntervalMs = 33L // ~30 Hz
-
             while (isRunning.get()) {
-                val now = System.currentTimeMillis()
-                if (now - lastKeepAlive > keepAliveIntervalMs) {
-                    sendKeepAlive()
-                    lastKeepAlive = now
+                // Preferred path: one long-lived event stream that delivers each change as it happens
+                val streamed = try {
+                    streamControls(udpSocket, espAddr)
+                } catch (e: Exception) {
+                    android.util.Log.w("HttpRelayService", "Control stream dropped: ${e.message}")
+                    false
                 }
 
-                try {
-                    val json = fetchControlsJson()
-                    if (json.isNotEmpty()) {
-                        val bytes = json.toByteArray()
-                        val packet = java.net.DatagramPacket(bytes, bytes.size, espAddr, ESP32_PORT)
-                        udpSocket.send(packet)
-                        android.util.Log.d("HttpRelayService", "Sent controls to ESP32 ${espAddr.hostAddress}:$ESP32_PORT -> $json")
+                if (!streamed && isRunning.get()) {
+                    // Stream unavailable: poll for a while, then try streaming again
+                    val retryAt = System.currentTimeMillis() + STREAM_RETRY_MS
+                    while (isRunning.get() && System.currentTimeMillis() < retryAt) {
+                        sendKeepAliveIfDue()
+                        try {
+                            val previousVersion = lastControlsVersion
+                            val json = fetchControlsJson()
+                            val receivedAt = System.currentTimeMillis()
+                            if (json.isNotEmpty()) {
+                                forwardControls(udpSocket, espAddr, takeCommands(udpSocket, espAddr, json))
+                                if (lastControlsVersion != previousVersion) {
+                                    reportFrameTimingIfDue(lastControlsVersion, receivedAt)
+                                }
+                            }
+                        } catch (e: Exception) {
+                            // network hiccup; continue loop
+                        }
+                        Thread.sleep(POLL_INTERVAL_MS)
                     }
-                } catch (e: Exception) {
-                    // network hiccup; continue loop
                 }
-
-                Thread.sleep(pollIntervalMs)
             }
             
         } catch (e: Exception) {
@@ -259,9 +308,125 @@ class HttpRelayService : Service() {
         }
     }
 
+    // Reads /api/stream_controls and forwards every frame to the ESP32 as it arrives.
+    // Heartbeats re-send the last frame so the ESP32 keeps hearing from us while the sticks are idle.
+    // Returns false if the stream could not be opened or ended before delivering anything.
+    private fun streamControls(udpSocket: java.net.DatagramSocket, espAddr: java.net.InetAddress): Boolean {
+        var connection: HttpURLConnection? = null
+        try {
+            val url = URL("$apiBase/api/stream_controls")
+            connection = url.openConnection() as HttpURLConnection
+            connection.requestMethod = "GET"
+            connection.connectTimeout = 5000
+            connection.readTimeout = STREAM_READ_TIMEOUT_MS
+            connection.setRequestProperty("Accept", "text/event-stream")
+            lastStreamEventId?.let { connection.setRequestProperty("Last-Event-ID", it) }
+
+            if (connection.responseCode != 200) {
+                return false
+            }
+
+            val reader = BufferedReader(InputStreamReader(connection.inputStream))
+            var delivered = false
+            var lastJson = ""
+            while (isRunning.get()) {
+                val line = reader.readLine() ?: break
+                when {
+                    line.startsWith("id:") -> lastStreamEventId = line.substring(3).trim()
+                    line.startsWith("data:") -> {
+                        val receivedAt = System.currentTimeMillis()
+                        lastJson = takeCommands(udpSocket, espAddr, line.substring(5).trim())
+                        forwardControls(udpSocket, espAddr, lastJson)
+                        delivered = true
+                        // Event ids are "<boot id>-<version>"
+                        reportFrameTimingIfDue(lastStreamEventId?.substringAfterLast('-'), receivedAt)
+                    }
+                    line.startsWith(":") && lastJson.isNotEmpty() -> forwardControls(udpSocket, espAddr, lastJson)
+                }
+                sendKeepAliveIfDue()
+            }
+            reader.close()
+            return delivered
+        } finally {
+            try { connection?.disconnect() } catch (_: Exception) {}
+        }
+    }
+
+    private fun forwardControls(udpSocket: java.net.DatagramSocket, espAddr: java.net.InetAddress, json: String) {
+        val bytes = json.toByteArray()
+        val packet = java.net.DatagramPacket(bytes, bytes.size, espAddr, ESP32_PORT)
+        udpSocket.send(packet)
+        android.util.Log.d("HttpRelayService", "Sent controls to ESP32 ${espAddr.hostAddress}:$ESP32_PORT -> $json")
+    }
+
+    // Forwards commands riding along in a control message to the ESP32, once per ID, and
+    // returns the controls JSON without them. The IDs are acked on the next fetch or keep-alive.
+    private fun takeCommands(udpSocket: java.net.DatagramSocket, espAddr: java.net.InetAddress, json: String): String {
+        if (!json.contains("\"commands\"")) {
+            return json
+        }
+        val message = org.json.JSONObject(json)
+        val commands = message.optJSONArray("commands") ?: return json
+        for (i in 0 until commands.length()) {
+            val entry = commands.getJSONObject(i)
+            val id = entry.getString("id")
+            if (id !in forwardedCommandIds) {
+                val bytes = entry.getString("command").toByteArray()
+                udpSocket.send(java.net.DatagramPacket(bytes, bytes.size, espAddr, ESP32_PORT))
+                android.util.Log.d("HttpRelayService", "Forwarded command $id to ESP32")
+                forwardedCommandIds.add(id)
+                if (forwardedCommandIds.size > MAX_REMEMBERED_COMMANDS) {
+                    forwardedCommandIds.remove(forwardedCommandIds.first())
+                }
+            }
+            // Re-ack repeats too, in case the earlier ack was lost
+            if (id !in pendingAcks) pendingAcks.add(id)
+        }
+        message.remove("commands")
+        return message.toString()
+    }
+
+    private fun ackQuery(): String =
+        if (pendingAcks.isEmpty()) "" else "?ack=" + pendingAcks.joinToString(",")
+
+    // Tells the server when a frame version arrived here and when it went out to the ESP32,
+    // sampled so the report traffic stays small next to the control stream.
+    private fun reportFrameTimingIfDue(version: String?, receivedAt: Long) {
+        val now = System.currentTimeMillis()
+        if (version == null || now - lastFrameReport < FRAME_REPORT_INTERVAL_MS) {
+            return
+        }
+        lastFrameReport = now
+        try {
+            val url = URL("$apiBase/phone/frame_ack")
+            val connection = url.openConnection() as HttpURLConnection
+            connection.requestMethod = "POST"
+            connection.connectTimeout = 2000
+            connection.readTimeout = 2000
+            connection.doOutput = true
+            connection.setRequestProperty("Content-Type", "application/json")
+            val body = "{\"version\":$version,\"received_at\":$receivedAt,\"forwarded_at\":$now}"
+            connection.outputStream.use { it.write(body.toByteArray()) }
+            connection.responseCode
+            connection.disconnect()
+        } catch (e: Exception) {
+            android.util.Log.w("HttpRelayService", "Frame timing report failed: ${e.message}")
+        }
+    }
+
+    private fun sendKeepAliveIfDue() {
+        val now = System.currentTimeMillis()
+        // Owed command acks go out right away rather than waiting for the next interval
+        if (now - lastKeepAlive > KEEP_ALIVE_INTERVAL_MS || pendingAcks.isNotEmpty()) {
+            sendKeepAlive()
+            lastKeepAlive = now
+        }
+    }
+
     private fun sendKeepAlive() {
         try {
-            val url = URL("$SERVER_URL/phone/keepalive")
+            val acked = pendingAcks.toList()
+            val url = URL("$apiBase/phone/keepalive${ackQuery()}")
             val connection = url.openConnection() as HttpURLConnection
             connection.requestMethod = "GET"
             connection.connectTimeout = 5000
@@ -269,6 +434,7 @@ class HttpRelayService : Service() {
             
             val responseCode = connection.responseCode
             if (responseCode == 200) {
+                pendingAcks.removeAll(acked)
                 android.util.Log.d("HttpRelayService", "Keep-alive sent successfully")
             } else {
                 android.util.Log.w("HttpRelayService", "Keep-alive failed with code: $responseCode")
@@ -284,13 +450,20 @@ class HttpRelayService : Service() {
     private fun fetchControlsJson(): String {
         var connection: HttpURLConnection? = null
         return try {
-            val url = URL("$SERVER_URL/api/get_controls")
+            val acked = pendingAcks.toList()
+            val url = URL("$apiBase/api/get_controls${ackQuery()}")
             connection = url.openConnection() as HttpURLConnection
             connection.requestMethod = "GET"
             connection.connectTimeout = 2000
             connection.readTimeout = 2000
+            connection.useCaches = false
+            // Unchanged controls come back as a bodyless 304
+            lastControlsEtag?.let { connection.setRequestProperty("If-None-Match", it) }
 
             val code = connection.responseCode
+            if (code == 200 || code == HttpURLConnection.HTTP_NOT_MODIFIED) {
+                pendingAcks.removeAll(acked)
+            }
             if (code == 200) {
                 val reader = BufferedReader(InputStreamReader(connection.inputStream))
                 val sb = StringBuilder()
@@ -299,7 +472,12 @@ class HttpRelayService : Service() {
                     sb.append(line)
                 }
                 reader.close()
-                sb.toString()
+                lastControlsJson = sb.toString()
+                lastControlsEtag = connection.getHeaderField("ETag")
+                lastControlsVersion = connection.getHeaderField("X-RC-Version")
+                lastControlsJson
+            } else if (code == HttpURLConnection.HTTP_NOT_MODIFIED) {
+                lastControlsJson
             } else {
                 ""
             }
@@ -0,0 +1,327 @@
+"""Load and latency benchmark for rc_web_server.py
+
+Starts the server as a subprocess plus a stub phone HTTP server, then drives
+it with simulated browsers (POST /api/controls at a fixed rate), relays
+(GET /api/get_controls) and dashboards (GET /api/status) for a fixed time.
+Prints throughput and latency percentiles per route and can save them as
+JSON to compare serving models run to run:
+
+    python rc_bench.py --mode threaded --output threaded.json
+    python rc_bench.py --mode pool --output pool.json --compare threaded.json
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rc_web_server.py')
+PERCENTILES = (50, 95, 99)
+
+class StubPhoneHandler(BaseHTTPRequestHandler):
+    """Stands in for the relay's local HTTP server: accepts pushes after a fixed delay"""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, Nagle plus delayed ACKs adds ~40 ms per push
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.pushes[self.path] = self.server.pushes.get(self.path, 0) + 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '15')
+        self.end_headers()
+        self.wfile.write(b'{"status":"ok"}')
+
+    def log_message(self, format, *args):
+        pass
+
+class StubPhoneServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, delay):
+        super().__init__(address, StubPhoneHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.pushes = {}        # route -> count
+
+class Recorder:
+    """Latency samples and error counts per route, merged from every client thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}       # route -> [latency_s]
+        self.errors = {}        # route -> count
+
+    def add(self, route, samples, errors):
+        with self.lock:
+            self.samples.setdefault(route, []).extend(samples)
+            self.errors[route] = self.errors.get(route, 0) + errors
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+def client_loop(host, port, method, path, route, interval, stop, recorder, body=None, headers=None, etag=False):
+    """Issue requests on a fixed schedule until `stop` is set
+
+    Latency is measured from the scheduled send time, not the actual one, so a
+    stalled server is charged for the requests that queued up behind the stall.
+    """
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    samples = []
+    errors = 0
+    last_etag = None
+    next_send = time.perf_counter()
+    while not stop.is_set():
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        scheduled = next_send
+        request_headers = dict(headers or {})
+        if etag and last_etag:
+            request_headers['If-None-Match'] = last_etag
+        payload = body() if callable(body) else body
+        try:
+            conn.request(method, path, payload, request_headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+            else:
+                samples.append(time.perf_counter() - scheduled)
+                last_etag = response.getheader('ETag', last_etag)
+            if response.will_close:
+                conn.close()
+        except (http.client.HTTPException, OSError):
+            errors += 1
+            conn.close()
+        next_send = scheduled + interval
+        if next_send < time.perf_counter() - interval:
+            # Too far behind to catch up; the missed slots are already in the latencies
+            next_send = time.perf_counter()
+    conn.close()
+    recorder.add(route, samples, errors)
+
+def browser_body():
+    t = time.time()
+    return json.dumps({
+        'throttle': (t % 10) / 10,
+        'aileron': ((t * 3) % 2) - 1,
+        'elevator': 0.0,
+        'rudder': 0.0,
+        't': t * 1000,
+    }).encode()
+
+def client_ip(kind, i):
+    # Every simulated client gets its own address so the server's per-client rate limits apply as in the field
+    return f'10.{kind}.{i // 256}.{i % 256}'
+
+def http_get(host, port, path, method='GET', timeout=5):
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request(method, path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+def wait_for_server(host, port, process, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with code {process.returncode}')
+        try:
+            status, _ = http_get(host, port, '/api/status', timeout=1)
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError('server did not come up')
+
+def parse_stage_metrics(text):
+    """Mean and count per stage from the server's /metrics histograms"""
+    stages = {}
+    for line in text.splitlines():
+        for suffix in ('_sum', '_count'):
+            prefix = 'rc_stage_latency_seconds' + suffix + '{stage="'
+            if line.startswith(prefix):
+                stage = line[len(prefix):line.index('"', len(prefix))]
+                stages.setdefault(stage, {})[suffix[1:]] = float(line.rsplit(' ', 1)[1])
+    return {
+        stage: {'count': int(v.get('count', 0)), 'mean_ms': round(v['sum'] / v['count'] * 1000, 3) if v.get('count') else None}
+        for stage, v in stages.items()
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(SERVER_SCRIPT), stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    host = '127.0.0.1'
+    phone = StubPhoneServer((host, args.phone_port), args.phone_delay)
+    threading.Thread(target=phone.serve_forever, name='stub-phone', daemon=True).start()
+
+    env = dict(os.environ, PORT=str(args.port), RC_SERVER_MODE=args.mode, RC_MAX_WORKERS=str(args.workers),
+               RC_PHONE_PORT=str(args.phone_port), RC_UDP_PORT='0', PYTHONUNBUFFERED='1',
+               # Simulated clients are told apart by X-Forwarded-For, as behind Render's proxy
+               RC_TRUST_PROXY='1')
+    env.pop('RC_FLIGHT_LOG_DIR', None)
+    log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT], env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        wait_for_server(host, args.port, process)
+        prefixes = [f'/v/bench-{i}' for i in range(args.vehicles)] if args.vehicles > 1 else ['']
+        for prefix in prefixes:
+            # Register the stub phone so every control change is pushed to it
+            http_get(host, args.port, prefix + '/phone/keepalive', method='POST')
+
+        stop = threading.Event()
+        recorder = Recorder()
+        clients = []
+        for i in range(args.browsers):
+            prefix = prefixes[i % len(prefixes)]
+            clients.append((
+                'POST', prefix + '/api/controls', '/api/controls', 1.0 / args.rate,
+                browser_body, {'Content-Type': 'application/json', 'X-Forwarded-For': client_ip(1, i)}, False,
+            ))
+        for i in range(args.relays):
+            prefix = prefixes[i % len(prefixes)]
+            clients.append((
+                'GET', prefix + '/api/get_controls', '/api/get_controls', 1.0 / args.relay_rate,
+                None, {'X-Forwarded-For': client_ip(2, i)}, True,
+            ))
+        for i in range(args.dashboards):
+            prefix = prefixes[i % len(prefixes)]
+            clients.append((
+                'GET', prefix + '/api/status', '/api/status', args.dashboard_interval,
+                None, {'X-Forwarded-For': client_ip(3, i)}, True,
+            ))
+
+        threads = [
+            threading.Thread(
+                target=client_loop, args=(host, args.port, method, path, route, interval, stop, recorder),
+                kwargs={'body': body, 'headers': headers, 'etag': etag}, daemon=True,
+            )
+            for method, path, route, interval, body, headers, etag in clients
+        ]
+        print(f"Running {args.browsers} browsers, {args.relays} relays, {args.dashboards} dashboards "
+              f"against {args.mode} mode for {args.duration:g}s...")
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=35)
+        elapsed = time.perf_counter() - started
+
+        _, metrics_text = http_get(host, args.port, '/metrics')
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        phone.shutdown()
+        if log is not subprocess.DEVNULL:
+            log.close()
+
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        routes[route] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(route, 0),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'max_ms': round(samples[-1] * 1000, 3) if samples else None,
+        }
+        for p in PERCENTILES:
+            value = percentile(samples, p)
+            routes[route][f'p{p}_ms'] = round(value * 1000, 3) if value is not None else None
+
+    return {
+        'revision': git_revision(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'mode': args.mode, 'workers': args.workers, 'duration_s': args.duration,
+            'browsers': args.browsers, 'browser_rate_hz': args.rate,
+            'relays': args.relays, 'relay_rate_hz': args.relay_rate,
+            'dashboards': args.dashboards, 'dashboard_interval_s': args.dashboard_interval,
+            'vehicles': args.vehicles, 'phone_delay_s': args.phone_delay,
+        },
+        'elapsed_s': round(elapsed, 3),
+        'routes': routes,
+        'phone_pushes': dict(phone.pushes),
+        'server_stages': parse_stage_metrics(metrics_text.decode()),
+    }
+
+def print_report(result, baseline=None):
+    print(f"\n{'route':<20}{'req/s':>9}{'errors':>8}" + ''.join(f"{'p%d ms' % p:>10}" for p in PERCENTILES) + f"{'max ms':>10}")
+    for route, stats in result['routes'].items():
+        row = f"{route:<20}{stats['throughput_rps']:>9.1f}{stats['errors']:>8}"
+        for p in PERCENTILES:
+            value = stats[f'p{p}_ms']
+            row += f"{value:>10.2f}" if value is not None else f"{'-':>10}"
+        row += f"{stats['max_ms']:>10.2f}" if stats['max_ms'] is not None else f"{'-':>10}"
+        old = (baseline or {}).get('routes', {}).get(route)
+        if old and old.get('p99_ms') and stats['p99_ms'] is not None:
+            row += f"   p99 {(stats['p99_ms'] - old['p99_ms']) / old['p99_ms'] * 100:+.0f}% vs baseline"
+        print(row)
+    print(f"\nphone pushes: {result['phone_pushes']}")
+    for stage, stats in result['server_stages'].items():
+        if stats['count']:
+            print(f"  {stage:<20} n={stats['count']:<8} mean={stats['mean_ms']:.3f} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load and latency benchmark for rc_web_server.py')
+    parser.add_argument('--mode', default='threaded', help='RC_SERVER_MODE for the server under test')
+    parser.add_argument('--workers', type=int, default=32, help='RC_MAX_WORKERS for the server under test')
+    parser.add_argument('--port', type=int, default=18080, help='port for the server under test')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load')
+    parser.add_argument('--browsers', type=int, default=4, help='browsers posting /api/controls')
+    parser.add_argument('--rate', type=float, default=30.0, help='control posts per second per browser')
+    parser.add_argument('--relays', type=int, default=4, help='relays polling /api/get_controls')
+    parser.add_argument('--relay-rate', type=float, default=30.0, help='polls per second per relay')
+    parser.add_argument('--dashboards', type=int, default=2, help='dashboards polling /api/status')
+    parser.add_argument('--dashboard-interval', type=float, default=2.0, help='seconds between status polls')
+    parser.add_argument('--vehicles', type=int, default=1, help='spread clients over this many vehicle sessions')
+    parser.add_argument('--phone-port', type=int, default=8080, help='port of the stub phone')
+    parser.add_argument('--phone-delay', type=float, default=0.0, help='seconds the stub phone takes per push')
+    parser.add_argument('--server-log', help='write server output here instead of discarding it')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='earlier JSON results to compare p99s against')
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == '__main__':
+    main()
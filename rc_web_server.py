@@ -1,91 +1,1637 @@
+import argparse
+import base64
+import bisect
+import gzip
+import hashlib
+import math
+import mmap
+import queue
+import re
+import selectors
+import signal
 import socket
+import socketserver
+import struct
 import threading
 import time
 import json
 import sys
+import http.client
 from datetime import datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import urllib.parse
+from array import array
+from collections import deque
 
 import os
 
 # Get port from environment (Render) or use default
 LISTEN_PORT = int(os.environ.get('PORT', 8080))
 
-phone_addr = None
-phone_last_seen = 0
-is_connected = False
+# Serving model: 'threaded' (thread per request), 'pool' (fixed worker pool) or 'single'
+SERVER_MODE = os.environ.get('RC_SERVER_MODE', 'threaded')
+# Upper bound on requests being handled at the same time
+MAX_WORKERS = int(os.environ.get('RC_MAX_WORKERS', 32))
+# Seconds a client socket may stay idle before its worker gives up on it
+REQUEST_TIMEOUT = float(os.environ.get('RC_REQUEST_TIMEOUT', 30))
+
+# Port of the HTTP server in the phone app and how long a single push may take
+PHONE_HTTP_PORT = int(os.environ.get('RC_PHONE_PORT', 8080))
+PHONE_PUSH_TIMEOUT = float(os.environ.get('RC_PHONE_PUSH_TIMEOUT', 2))
+
+# Workers kept free for short control requests: held-open connections, waiting long-polls and bulk
+# requests (running or queued) together may never occupy more than MAX_WORKERS - CONTROL_RESERVE.
+# The defaults below are shares of MAX_WORKERS that fit; make_server refuses budgets that do not
+CONTROL_RESERVE = int(os.environ.get('RC_CONTROL_RESERVE', max(1, MAX_WORKERS // 4)))
+
+# Held-open connections allowed at once: relay event streams and browser control WebSockets each have
+# their own pool so open pages cannot lock relays out. Then the stream heartbeat period and longest long-poll wait (s)
+MAX_STREAMS = int(os.environ.get('RC_MAX_STREAMS', max(1, MAX_WORKERS // 6)))
+MAX_CONTROL_SOCKETS = int(os.environ.get('RC_MAX_CONTROL_SOCKETS', max(1, MAX_WORKERS // 6)))
+STREAM_HEARTBEAT = float(os.environ.get('RC_STREAM_HEARTBEAT', 1.0))
+LONG_POLL_MAX_WAIT = float(os.environ.get('RC_LONG_POLL_MAX_WAIT', 25))
+# Long-polls allowed to wait at once; past that they are answered straight away so they cannot
+# tie up the workers control writes need
+MAX_LONG_POLLS = int(os.environ.get('RC_MAX_LONG_POLLS', max(1, MAX_WORKERS // 8)))
+
+# Dashboard viewers on /api/watch: how many, fastest update rate per vehicle (s between updates),
+# heartbeat period (s) and how many unsent bytes a viewer may fall behind before it is dropped
+MAX_VIEWERS = int(os.environ.get('RC_MAX_VIEWERS', 256))
+VIEWER_MIN_INTERVAL = float(os.environ.get('RC_VIEWER_MIN_INTERVAL', 0.05))
+VIEWER_HEARTBEAT = float(os.environ.get('RC_VIEWER_HEARTBEAT', 15))
+VIEWER_MAX_BACKLOG = int(os.environ.get('RC_VIEWER_MAX_BACKLOG', 64 * 1024))
+
+# Admission control: per-client request rate and burst for the control and bulk lanes (rate 0 = unlimited),
+# how many bulk requests run at once, how many may wait for a turn and for how long (s)
+CONTROL_RATE = float(os.environ.get('RC_CONTROL_RATE', 200))
+CONTROL_BURST = float(os.environ.get('RC_CONTROL_BURST', 400))
+BULK_RATE = float(os.environ.get('RC_BULK_RATE', 5))
+BULK_BURST = float(os.environ.get('RC_BULK_BURST', 20))
+BULK_SLOTS = int(os.environ.get('RC_BULK_SLOTS', max(1, MAX_WORKERS // 8)))
+BULK_QUEUE = int(os.environ.get('RC_BULK_QUEUE', BULK_SLOTS))
+BULK_QUEUE_WAIT = float(os.environ.get('RC_BULK_QUEUE_WAIT', 0.25))
+# Behind Render's proxy every connection comes from the proxy, so clients are told apart by the
+# X-Forwarded-For entry it appends. Only trusted on Render (which sets RENDER) unless configured
+TRUST_PROXY = os.environ.get('RC_TRUST_PROXY', '1' if os.environ.get('RENDER') else '0') == '1'
+
+# UDP control-frame port (0 disables it) and how long a subscriber lives without a fresh hello (s)
+UDP_PORT = int(os.environ.get('RC_UDP_PORT', 4210))
+UDP_SUBSCRIBER_TTL = float(os.environ.get('RC_UDP_SUBSCRIBER_TTL', 60))
+# How long a sender's last seq is remembered without a frame (s), how many senders are tracked
+# at once, and how far (ms) a sender's frame clock must jump back to count as a restart
+UDP_SENDER_TTL = float(os.environ.get('RC_UDP_SENDER_TTL', 5))
+MAX_UDP_SENDERS = int(os.environ.get('RC_MAX_UDP_SENDERS', 256))
+UDP_RESTART_GAP_MS = int(os.environ.get('RC_UDP_RESTART_GAP_MS', 1000))
+
+# Telemetry samples kept in memory for /api/telemetry
+TELEMETRY_CAPACITY = int(os.environ.get('RC_TELEMETRY_CAPACITY', 18000))
+
+# Flight recorder: directory for .rclog segments (unset disables it) and segment size
+FLIGHT_LOG_DIR = os.environ.get('RC_FLIGHT_LOG_DIR', '')
+FLIGHT_LOG_SEGMENT_MB = int(os.environ.get('RC_FLIGHT_LOG_SEGMENT_MB', 64))
+
+# Xbox controller: transmit rate (Hz) and smallest axis change worth sending
+XBOX_TICK_HZ = float(os.environ.get('RC_XBOX_TICK_HZ', 50))
+XBOX_AXIS_DEADBAND = float(os.environ.get('RC_XBOX_DEADBAND', 0.005))
+XBOX_VEHICLE = os.environ.get('RC_XBOX_VEHICLE', 'default')
+
+# Link-loss failsafe: seconds without control input before throttle drops to RC_FAILSAFE_THROTTLE (0 disables),
+# seconds without a relay keep-alive before a phone counts as gone, and the deadline timer resolution (s)
+FAILSAFE_TIMEOUT = float(os.environ.get('RC_FAILSAFE_TIMEOUT', 2.0))
+FAILSAFE_THROTTLE = float(os.environ.get('RC_FAILSAFE_THROTTLE', 0.0))
+PHONE_TIMEOUT = float(os.environ.get('RC_PHONE_TIMEOUT', 45))
+DEADLINE_TICK = float(os.environ.get('RC_DEADLINE_TICK', 0.05))
+
+# Commands awaiting a relay acknowledgement: how many one vehicle may have queued and how long each may wait (s)
+MAX_PENDING_COMMANDS = int(os.environ.get('RC_MAX_PENDING_COMMANDS', 16))
+COMMAND_TTL = float(os.environ.get('RC_COMMAND_TTL', 30))
+
+# Input shaping, applied server-side to every input source. Per-axis settings are 'axis=value' lists:
+# deadzone (fraction of travel around centre, or above idle for throttle), expo (0 linear .. 1 cubic),
+# trim (offset added before mixing) and rate limit (most an output may move per second, 0 = unlimited).
+# The mix is 'none', 'elevon' or 'vtail'
+SHAPING_DEADZONE = os.environ.get('RC_DEADZONE', 'aileron=0.06,elevator=0.06,rudder=0.06')
+SHAPING_EXPO = os.environ.get('RC_EXPO', '')
+SHAPING_TRIM = os.environ.get('RC_TRIM', '')
+SHAPING_RATE_LIMIT = os.environ.get('RC_RATE_LIMIT', '')
+SHAPING_MIX = os.environ.get('RC_MIX', 'none')
+
+# Vehicle sessions: the one unprefixed routes and legacy relays talk to, and how many one process keeps
+DEFAULT_VEHICLE = 'default'
+MAX_SESSIONS = int(os.environ.get('RC_MAX_SESSIONS', 64))
+# Seconds a vehicle session may go without a relay or control input before it is dropped (the default vehicle never is)
+SESSION_IDLE_TIMEOUT = float(os.environ.get('RC_SESSION_IDLE_TIMEOUT', 600))
 
 # RC Control structure
+CONTROL_FIELDS = ('throttle', 'aileron', 'elevator', 'rudder', 'armed', 'flight_mode')
+
+class ControlFrame:
+    """Immutable snapshot of the RC controls. Encodings are cached on the frame itself"""
+    __slots__ = CONTROL_FIELDS + ('version', 'updated_at', 'updated_ms', '_encoded')
+
+    def __init__(self, throttle=0.0, aileron=0.0, elevator=0.0, rudder=0.0, armed=False, flight_mode=0,
+                 version=0, updated_at=None, updated_ms=None):
+        init = object.__setattr__
+        init(self, 'throttle', throttle)        # 0.0 to 1.0
+        init(self, 'aileron', aileron)          # -1.0 to 1.0 (left/right)
+        init(self, 'elevator', elevator)        # -1.0 to 1.0 (up/down)
+        init(self, 'rudder', rudder)            # -1.0 to 1.0 (left/right)
+        init(self, 'armed', armed)              # Safety switch
+        init(self, 'flight_mode', flight_mode)  # 0=manual, 1=stabilized, 2=auto
+        init(self, 'version', version)
+        init(self, 'updated_at', time.time() if updated_at is None else updated_at)
+        init(self, 'updated_ms', monotonic_ms() if updated_ms is None else updated_ms)
+        init(self, '_encoded', {})              # encoding -> bytes
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ControlFrame is immutable; use RCControls.apply()')
+
+    def values(self):
+        return {name: getattr(self, name) for name in CONTROL_FIELDS}
+
+    def encode(self, encoding='json'):
+        """Serialized frame as bytes ('json' or 'binary'), built at most once"""
+        payload = self._encoded.get(encoding)
+        if payload is not None:
+            return payload
+        started = time.perf_counter()
+        if encoding == 'json':
+            payload = json.dumps({
+                'throttle': self.throttle,
+                'aileron': self.aileron,
+                'elevator': self.elevator,
+                'rudder': self.rudder,
+                'armed': self.armed,
+                'flight_mode': self.flight_mode,
+                'timestamp': datetime.fromtimestamp(self.updated_at).isoformat()
+            }).encode()
+        elif encoding == 'binary':
+            payload = encode_control_frame(self, self.version, self.updated_ms)
+        else:
+            raise ValueError(f"Unknown encoding '{encoding}'")
+        metrics.observe('serialize', time.perf_counter() - started)
+        self._encoded[encoding] = payload
+        return payload
+
+    def to_json(self):
+        return self.encode('json').decode()
+
 class RCControls:
+    """Current RC controls: an immutable ControlFrame swapped atomically on every change
+
+    Readers take `snapshot` once and get a consistent frame without locking.
+    All writes go through apply(), which builds the next frame from a whole
+    set of changes, so readers never see half an update.
+    """
+    __slots__ = ('snapshot', '_write_lock')
+
     def __init__(self):
-        self.throttle = 0.0      # 0.0 to 1.0
-        self.aileron = 0.0       # -1.0 to 1.0 (left/right)
-        self.elevator = 0.0      # -1.0 to 1.0 (up/down)
-        self.rudder = 0.0        # -1.0 to 1.0 (left/right)
-        self.armed = False       # Safety switch
-        self.flight_mode = 0     # 0=manual, 1=stabilized, 2=auto
-        
+        self.snapshot = ControlFrame()
+        self._write_lock = threading.Lock()
+
+    def apply(self, toggle_arm=False, cycle_mode=False, **changes):
+        """Apply a set of field changes in one step; returns the resulting frame"""
+        with self._write_lock:
+            current = self.snapshot
+            values = current.values()
+            values.update(changes)
+            if toggle_arm:
+                values['armed'] = not values['armed']
+            if cycle_mode:
+                values['flight_mode'] = (values['flight_mode'] + 1) % 3
+            if all(values[name] == getattr(current, name) for name in CONTROL_FIELDS):
+                return current
+            frame = ControlFrame(version=current.version + 1, **values)
+            self.snapshot = frame
+            return frame
+
+    # Read-only views of the current frame
+    version = property(lambda self: self.snapshot.version)
+    throttle = property(lambda self: self.snapshot.throttle)
+    aileron = property(lambda self: self.snapshot.aileron)
+    elevator = property(lambda self: self.snapshot.elevator)
+    rudder = property(lambda self: self.snapshot.rudder)
+    armed = property(lambda self: self.snapshot.armed)
+    flight_mode = property(lambda self: self.snapshot.flight_mode)
+
+    def encode(self, encoding='json'):
+        return self.snapshot.encode(encoding)
+
+    def encode_with_version(self, encoding='json'):
+        """Like encode(), but also returns the version the bytes were built from"""
+        frame = self.snapshot
+        return frame.version, frame.encode(encoding)
+
     def to_json(self):
-        return json.dumps({
-            'throttle': self.throttle,
-            'aileron': self.aileron,
-            'elevator': self.elevator,
-            'rudder': self.rudder,
-            'armed': self.armed,
-            'flight_mode': self.flight_mode,
-            'timestamp': datetime.now().isoformat()
-        })
-
-# Global RC controls
-rc_controls = RCControls()
+        return self.snapshot.to_json()
 
-class RCHTTPHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        global phone_addr, phone_last_seen, is_connected, rc_controls
-        
-        parsed_path = urllib.parse.urlparse(self.path)
-        path = parsed_path.path
-        
-        if path == '/':
-            # Main control page
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            
-            html = f"""
-<!DOCTYPE html>
+# Compact binary control frame, little-endian, 20 bytes:
+#   magic u8, version u8, type u8, flags u8 (bit 0 armed, bits 1-2 flight mode),
+#   seq u32, throttle u16 (0..65535), aileron/elevator/rudder i16 (-32767..32767),
+#   t_ms u32 (sender's monotonic clock in ms, wraps)
+FRAME_MAGIC = 0xA5
+FRAME_VERSION = 1
+FRAME_TYPE_CONTROLS = 0
+FRAME_TYPE_HELLO = 1        # header only; subscribes the sender to control frames
+FRAME_FLAG_ARMED = 0x01
+FRAME_FLAG_JSON = 0x80      # on a hello: send JSON instead of binary frames
+FRAME_HEADER = struct.Struct('<BBBB')
+FRAME_STRUCT = struct.Struct('<BBBBIHhhhI')
+
+def monotonic_ms():
+    return int(time.monotonic() * 1000) & 0xFFFFFFFF
+
+def encode_control_frame(controls, seq, t_ms=None):
+    """Pack RC controls into a binary control frame"""
+    flags = (FRAME_FLAG_ARMED if controls.armed else 0) | ((controls.flight_mode & 0x03) << 1)
+    return FRAME_STRUCT.pack(
+        FRAME_MAGIC, FRAME_VERSION, FRAME_TYPE_CONTROLS, flags,
+        seq & 0xFFFFFFFF,
+        round(min(max(controls.throttle, 0.0), 1.0) * 65535),
+        round(min(max(controls.aileron, -1.0), 1.0) * 32767),
+        round(min(max(controls.elevator, -1.0), 1.0) * 32767),
+        round(min(max(controls.rudder, -1.0), 1.0) * 32767),
+        monotonic_ms() if t_ms is None else t_ms & 0xFFFFFFFF,
+    )
+
+def decode_control_frame(data):
+    """Unpack a binary control frame into a control-input dict with 'seq' and 't_ms'"""
+    if len(data) != FRAME_STRUCT.size:
+        raise ValueError(f'control frame must be {FRAME_STRUCT.size} bytes, got {len(data)}')
+    magic, version, frame_type, flags, seq, throttle, aileron, elevator, rudder, t_ms = FRAME_STRUCT.unpack(data)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION or frame_type != FRAME_TYPE_CONTROLS:
+        raise ValueError(f'unsupported frame magic={magic:#x} version={version} type={frame_type}')
+    return {
+        'seq': seq,
+        't_ms': t_ms,
+        'throttle': throttle / 65535.0,
+        'aileron': aileron / 32767.0,
+        'elevator': elevator / 32767.0,
+        'rudder': rudder / 32767.0,
+        'armed': bool(flags & FRAME_FLAG_ARMED),
+        'flight_mode': min((flags >> 1) & 0x03, 2),
+    }
+
+def seq_is_newer(seq, last_seq):
+    """Compare 32-bit sequence numbers, allowing for wrap-around"""
+    return last_seq is None or 0 < ((seq - last_seq) & 0xFFFFFFFF) < 0x80000000
+
+class CommandQueue:
+    """Bounded queue of one vehicle's commands, held until the relay acknowledges them by ID
+
+    Pending commands ride along in every JSON control message the relay
+    fetches or streams, so delivering one needs no request of its own. The
+    relay names the IDs it forwarded in `ack` on its next fetch or
+    keep-alive; anything still unacknowledged after `ttl` expires. Recent
+    outcomes are kept so /api/command can report them.
+    """
+
+    def __init__(self, max_pending, ttl, history=256):
+        self.lock = threading.Lock()
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.pending = {}               # id -> command, oldest first
+        self.states = {}                # id -> 'pending', 'delivered' or 'expired'
+        self.history = deque()          # ids in `states`, oldest first
+        self.history_size = history
+        self.last_id = 0                # also tells stream readers a command was queued
+        self.revision = 0               # bumped whenever the pending set changes
+        self.encoded = (0, b'')         # (revision, JSON array of pending commands)
+        self.delivered = 0
+        self.expired = 0
+
+    def submit(self, command):
+        """Queue a command; returns its ID, or None when the queue is full"""
+        with self.lock:
+            if len(self.pending) >= self.max_pending:
+                return None
+            self.last_id += 1
+            command_id = self.last_id
+            self.pending[command_id] = command
+            self.set_state(command_id, 'pending')
+            self.revision += 1
+        return command_id
+
+    def acknowledge(self, ids):
+        """Mark the given IDs delivered; returns how many were still pending"""
+        acked = 0
+        with self.lock:
+            for command_id in ids:
+                if self.pending.pop(command_id, None) is not None:
+                    self.set_state(command_id, 'delivered')
+                    acked += 1
+            if acked:
+                self.delivered += acked
+                self.revision += 1
+        return acked
+
+    def expire(self, command_id):
+        with self.lock:
+            command = self.pending.pop(command_id, None)
+            if command is None:
+                return None
+            self.set_state(command_id, 'expired')
+            self.expired += 1
+            self.revision += 1
+        return command
+
+    def set_state(self, command_id, state):
+        # Called with the lock held
+        if command_id not in self.states:
+            self.history.append(command_id)
+            if len(self.history) > self.history_size:
+                del self.states[self.history.popleft()]
+        self.states[command_id] = state
+
+    def state(self, command_id):
+        return self.states.get(command_id)
+
+    def encode(self):
+        """Return (revision, JSON array bytes) of the pending commands; b'' when there are none"""
+        encoded = self.encoded
+        if encoded[0] == self.revision:
+            return encoded
+        with self.lock:
+            pending = [{'id': command_ref(command_id), 'command': command} for command_id, command in self.pending.items()]
+            encoded = (self.revision, json.dumps(pending).encode() if pending else b'')
+        self.encoded = encoded
+        return encoded
+
+def with_commands(body, commands):
+    """Splice a pending-commands array into a JSON control object"""
+    if not commands:
+        return body
+    return body[:-1] + b', "commands": ' + commands + b'}'
+
+# Counters restart with the process, so command IDs on the wire are "<BOOT_ID>-<n>";
+# a relay that remembers IDs from before a restart can never mistake a new command for one
+def command_ref(command_id):
+    return f'{BOOT_ID}-{command_id}'
+
+def parse_command_ref(ref):
+    """Queue ID named by a wire command ID; None if it belongs to an earlier boot"""
+    boot, _, number = ref.strip().rpartition('-')
+    command_id = int(number)
+    return command_id if boot == BOOT_ID else None
+
+def parse_acks(query):
+    """This boot's command IDs from an ?ack=<id>,<id> query parameter"""
+    ids = []
+    for value in query.get('ack', ()):
+        for part in value.split(','):
+            if part.strip():
+                command_id = parse_command_ref(part)
+                if command_id is not None:
+                    ids.append(command_id)
+    return ids
+
+class ControlFeed:
+    """Wakes long-poll and stream readers when the RC controls version moves or a command is queued"""
+
+    def __init__(self, controls, commands):
+        self.cond = threading.Condition()
+        self.controls = controls
+        self.commands = commands
+
+    @property
+    def version(self):
+        return self.controls.version
+
+    def publish(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def wait_for_change(self, since, timeout, last_command=None):
+        """Block until the version moves past `since` (or a command after `last_command` is queued)
+        or the timeout runs out; returns the current frame"""
+        with self.cond:
+            self.cond.wait_for(
+                lambda: self.controls.version != since
+                or (last_command is not None and self.commands.last_id != last_command),
+                timeout,
+            )
+            return self.controls.snapshot
+
+def axis_value(value):
+    """An axis value from a client as a float; NaN and infinities are refused before they reach the shaper"""
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f'axis values must be finite, got {value}')
+    return value
+
+def apply_single_control(session, control, value):
+    """Set one axis by name, as sent by the page sliders"""
+    value = axis_value(value)
+    session.input_seen()
+    if control in SHAPED_AXES:
+        session.apply_input({control: value})
+
+def apply_control_input(session, data):
+    """Apply a bulk control frame from the browser gamepad as one update"""
+    changes = {axis: axis_value(data[axis]) for axis in SHAPED_AXES if axis in data}
+    session.input_seen()
+    session.apply_input(changes, toggle_arm=bool(data.get('toggleArm')), cycle_mode=bool(data.get('cycleMode')))
+
+# Stick axes in shaping order; throttle runs 0..1, the rest -1..1
+SHAPED_AXES = ('throttle', 'aileron', 'elevator', 'rudder')
+AXIS_INDEX = {axis: i for i, axis in enumerate(SHAPED_AXES)}
+AXIS_RANGES = ((0.0, 1.0), (-1.0, 1.0), (-1.0, 1.0), (-1.0, 1.0))
+
+# Table intervals per axis curve; linear interpolation between entries keeps the error far below a servo step
+SHAPING_TABLE_SIZE = 1024
+
+# Channel mixes: output channel -> ((input axis, weight), ...); channels not listed pass straight through.
+# Weights are halved so full deflection on both inputs still fits the servo's travel
+CHANNEL_MIXES = {
+    'none': {},
+    # Flying wing: the aileron and elevator channels drive the left and right elevons
+    'elevon': {
+        'aileron': (('elevator', 0.5), ('aileron', 0.5)),
+        'elevator': (('elevator', 0.5), ('aileron', -0.5)),
+    },
+    # V-tail: the elevator and rudder channels drive the left and right ruddervators
+    'vtail': {
+        'elevator': (('elevator', 0.5), ('rudder', 0.5)),
+        'rudder': (('elevator', 0.5), ('rudder', -0.5)),
+    },
+}
+
+def axis_settings(spec):
+    """Parse an 'axis=value,...' setting into {axis: float}"""
+    settings = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        axis, _, value = item.partition('=')
+        axis = axis.strip()
+        if axis not in AXIS_INDEX:
+            raise ValueError(f"unknown axis '{axis}' in '{spec}'")
+        settings[axis] = float(value)
+    return settings
+
+def shaping_curve(x, deadzone, expo):
+    """Deadzone then expo, rescaled so the curve still reaches full travel"""
+    magnitude = abs(x)
+    if magnitude <= deadzone:
+        return 0.0
+    s = (magnitude - deadzone) / (1.0 - deadzone)
+    return math.copysign((1.0 - expo) * s + expo * s * s * s, x)
+
+class ShapingProfile:
+    """Precomputed input shaping shared by every vehicle: one curve table per axis, trims, mix and rate limits
+
+    All the curve maths happens here, once; shaping a frame is then a
+    table lookup per axis plus a handful of multiply-adds, whatever the
+    curve settings are.
+    """
+
+    def __init__(self, deadzone=None, expo=None, trim=None, rate_limit=None, mix='none'):
+        deadzone, expo, trim, rate_limit = deadzone or {}, expo or {}, trim or {}, rate_limit or {}
+        if mix not in CHANNEL_MIXES:
+            raise ValueError(f"unknown mix '{mix}' (expected one of: {', '.join(CHANNEL_MIXES)})")
+        self.mix_name = mix
+        self.tables = []
+        self.scales = []
+        for axis, (low, high) in zip(SHAPED_AXES, AXIS_RANGES):
+            dz = deadzone.get(axis, 0.0)
+            ex = expo.get(axis, 0.0)
+            if not 0.0 <= dz < 1.0 or not 0.0 <= ex <= 1.0:
+                raise ValueError(f'{axis}: deadzone must be in [0, 1) and expo in [0, 1]')
+            step = (high - low) / SHAPING_TABLE_SIZE
+            self.tables.append(array('d', (shaping_curve(low + i * step, dz, ex) for i in range(SHAPING_TABLE_SIZE + 1))))
+            self.scales.append(1.0 / step)
+        self.trims = [trim.get(axis, 0.0) for axis in SHAPED_AXES]
+        mixes = CHANNEL_MIXES[mix]
+        self.mix = [
+            tuple((AXIS_INDEX[source], weight) for source, weight in mixes.get(axis, ((axis, 1.0),)))
+            for axis in SHAPED_AXES
+        ]
+        self.rate_limits = [rate_limit.get(axis, 0.0) for axis in SHAPED_AXES]
+        self.rate_limited = any(self.rate_limits)
+        self.settings = {'deadzone': deadzone, 'expo': expo, 'trim': trim, 'rate_limit': rate_limit, 'mix': mix}
+
+    @classmethod
+    def from_env(cls):
+        return cls(axis_settings(SHAPING_DEADZONE), axis_settings(SHAPING_EXPO), axis_settings(SHAPING_TRIM),
+                   axis_settings(SHAPING_RATE_LIMIT), SHAPING_MIX)
+
+    def evaluate(self, raw):
+        """Shape one frame of raw axis values (in SHAPED_AXES order) into clamped output positions"""
+        curved = []
+        for i, x in enumerate(raw):
+            low, high = AXIS_RANGES[i]
+            pos = (min(max(x, low), high) - low) * self.scales[i]
+            k = int(pos)
+            table = self.tables[i]
+            if k >= SHAPING_TABLE_SIZE:
+                value = table[SHAPING_TABLE_SIZE]
+            else:
+                value = table[k] + (table[k + 1] - table[k]) * (pos - k)
+            curved.append(value + self.trims[i])
+        out = []
+        for (low, high), row in zip(AXIS_RANGES, self.mix):
+            value = 0.0
+            for source, weight in row:
+                value += curved[source] * weight
+            out.append(min(max(value, low), high))
+        return out
+
+class InputShaper:
+    """One vehicle's pass through the shaping profile
+
+    Keeps the latest raw value of every axis, since a mix or a single
+    slider move still needs the whole frame, and the last output for the
+    rate limiter. shape() reports when rate limiting held an output back
+    so the caller can come back and let it catch up.
+    """
+
+    def __init__(self, profile, step_time):
+        self.profile = profile
+        self.step_time = step_time      # longest interval one rate-limited step may cover
+        self.lock = threading.Lock()
+        self.raw = [0.0] * len(SHAPED_AXES)
+        self.output = [0.0] * len(SHAPED_AXES)      # starts where a new ControlFrame does
+        self.updated = time.monotonic()
+        self.settling = False
+
+    def raw_value(self, axis):
+        return self.raw[AXIS_INDEX[axis]]
+
+    def shape(self, changes):
+        """Fold raw axis changes in and shape the frame; returns ({axis: output}, still_settling)"""
+        started = time.perf_counter()
+        profile = self.profile
+        settling = False
+        with self.lock:
+            for axis, value in changes.items():
+                self.raw[AXIS_INDEX[axis]] = value
+            out = profile.evaluate(self.raw)
+            now = time.monotonic()
+            if profile.rate_limited:
+                # A slew under way covers all the time since its last step; a target that just
+                # moved only gets one step's worth of travel, however long it sat still
+                dt = now - self.updated
+                if not self.settling:
+                    dt = min(dt, self.step_time)
+                for i, rate in enumerate(profile.rate_limits):
+                    delta = out[i] - self.output[i]
+                    if rate and abs(delta) > rate * dt:
+                        out[i] = self.output[i] + math.copysign(rate * dt, delta)
+                        settling = True
+            self.output = out
+            self.updated = now
+            self.settling = settling
+        metrics.observe('shape', time.perf_counter() - started)
+        return dict(zip(SHAPED_AXES, out)), settling
+
+    def hold(self, axis, value):
+        """Force an axis to `value` as both input and output, as the failsafe does"""
+        with self.lock:
+            i = AXIS_INDEX[axis]
+            self.raw[i] = value
+            self.output[i] = value
+
+shaping_profile = ShapingProfile.from_env()
+
+# Minimal RFC 6455 framing for the browser input channel
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_OP_CONTINUATION = 0x0
+WS_OP_TEXT = 0x1
+WS_OP_BINARY = 0x2
+WS_OP_CLOSE = 0x8
+WS_OP_PING = 0x9
+WS_OP_PONG = 0xA
+WS_MAX_MESSAGE = 64 * 1024
+
+class WebSocketError(Exception):
+    pass
+
+def ws_accept_key(key):
+    digest = hashlib.sha1((key.strip() + WS_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+def ws_read_exact(rfile, n):
+    data = rfile.read(n)
+    if len(data) < n:
+        raise EOFError('WebSocket closed mid-frame')
+    return data
+
+def ws_read_frame(rfile):
+    """Read one frame; returns (fin, opcode, unmasked payload)"""
+    b0, b1 = ws_read_exact(rfile, 2)
+    fin = bool(b0 & 0x80)
+    opcode = b0 & 0x0F
+    length = b1 & 0x7F
+    if not b1 & 0x80:
+        raise WebSocketError('client frames must be masked')
+    if length == 126:
+        length = struct.unpack('!H', ws_read_exact(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', ws_read_exact(rfile, 8))[0]
+    if length > WS_MAX_MESSAGE:
+        raise WebSocketError('frame too large')
+    mask = ws_read_exact(rfile, 4)
+    payload = ws_read_exact(rfile, length)
+    if length:
+        # Unmask the whole payload with one big-integer XOR
+        key = (mask * (length // 4 + 1))[:length]
+        payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+    return fin, opcode, payload
+
+def ws_read_message(rfile):
+    """Read a complete message, reassembling fragments; control frames are returned as they come"""
+    fin, opcode, payload = ws_read_frame(rfile)
+    if opcode >= WS_OP_CLOSE or fin:
+        return opcode, payload
+    parts = [payload]
+    size = len(payload)
+    while True:
+        fin, next_opcode, payload = ws_read_frame(rfile)
+        if next_opcode == WS_OP_PING:
+            continue
+        if next_opcode != WS_OP_CONTINUATION:
+            raise WebSocketError('expected continuation frame')
+        size += len(payload)
+        if size > WS_MAX_MESSAGE:
+            raise WebSocketError('message too large')
+        parts.append(payload)
+        if fin:
+            return opcode, b''.join(parts)
+
+def ws_send_frame(wfile, opcode, payload=b''):
+    """Write one unmasked, unfragmented server frame"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    wfile.write(header + payload)
+
+# Workers each kind of held-open connection may occupy at once
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+control_socket_slots = threading.BoundedSemaphore(MAX_CONTROL_SOCKETS)
+long_poll_slots = threading.BoundedSemaphore(MAX_LONG_POLLS)
+
+def controls_changed(session, received=None):
+    """Announce a vehicle's new control state to its streams, long-polls, UDP subscribers and phone
+
+    `received` is the perf_counter() stamp taken when the input arrived.
+    """
+    session.feed.publish()
+    session.remember_frame(session.controls.snapshot)
+    if session.flight_log is not None:
+        session.flight_log.append(RECORD_CONTROLS, session.controls.encode('binary'))
+    if udp_endpoint is not None:
+        udp_endpoint.broadcast(session)
+    if session.phone_addr:
+        send_rc_controls_to_phone(session)
+    viewer_broadcaster.publish(session)
+    if received is not None:
+        metrics.observe('ingest_to_publish', time.perf_counter() - received)
+
+FRAME_CONTENT_TYPE = 'application/vnd.rc-frame'
+
+# Versions restart at 0 with the process, so ETags also name the process they came from
+BOOT_ID = format(int(time.time() * 1000) & 0xFFFFFFFF, 'x')
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header names `etag` (or is '*')"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate == etag or candidate == 'W/' + etag:
+            return True
+    return False
+
+# Upper bounds (s) of the latency histogram buckets, sub-millisecond hops up to multi-second stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stages a control frame passes through between the stick and the ESP32, in order
+LATENCY_STAGES = {
+    'origin_to_ingest': 'page stamp to server receipt (page and server clocks)',
+    'ingest_to_publish': 'server receipt until streams, UDP and the phone queue have the frame',
+    'shape': 'input shaping of one frame (curves, trims, mix, rate limits)',
+    'serialize': 'encoding a frame into one wire format',
+    'queue_to_push': 'wait in the phone sender queue',
+    'phone_push': 'HTTP round trip of a control push to the phone',
+    'publish_to_fetch': 'frame update until a waiting long-poll or stream sends it',
+    'server_to_relay': 'frame update until the relay received it (server and phone clocks)',
+    'relay_forward': 'relay receipt until its datagram to the ESP32 went out',
+}
+
+class Histogram:
+    """Fixed-bucket histogram; an observation is one bisect and three additions"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(bounds) + 1)     # last bucket is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.total, self.count
+
+class Metrics:
+    """Stage latencies plus request and error counters, exposed at /metrics in Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {stage: Histogram() for stage in LATENCY_STAGES}
+        self.requests = {}      # (route, status) -> count
+        self.errors = {}        # kind -> count
+
+    def observe(self, stage, seconds):
+        # Stages measured across two clocks can come out slightly negative
+        self.stages[stage].observe(max(seconds, 0.0))
+
+    def count_request(self, route, status):
+        with self.lock:
+            self.requests[route, status] = self.requests.get((route, status), 0) + 1
+
+    def count_error(self, kind):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def render(self):
+        lines = [
+            '# HELP rc_stage_latency_seconds Time a control frame spends in each pipeline stage.',
+            '# TYPE rc_stage_latency_seconds histogram',
+        ]
+        for stage, histogram in self.stages.items():
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, n in zip(histogram.bounds + (math.inf,), counts):
+                cumulative += n
+                le = '+Inf' if bound == math.inf else repr(bound)
+                lines.append(f'rc_stage_latency_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'rc_stage_latency_seconds_sum{{stage="{stage}"}} {total!r}')
+            lines.append(f'rc_stage_latency_seconds_count{{stage="{stage}"}} {count}')
+
+        with self.lock:
+            requests = sorted(self.requests.items())
+            errors = sorted(self.errors.items())
+        lines += ['# HELP rc_http_requests_total HTTP responses by route and status.', '# TYPE rc_http_requests_total counter']
+        lines += [f'rc_http_requests_total{{route="{route}",code="{status}"}} {n}' for (route, status), n in requests]
+        lines += ['# HELP rc_errors_total Failures outside the HTTP status codes, by kind.', '# TYPE rc_errors_total counter']
+        lines += [f'rc_errors_total{{kind="{kind}"}} {n}' for kind, n in errors]
+        admitted = admission.stats()
+        lines += ['# HELP rc_shed_total Requests refused by admission control, by route and reason.', '# TYPE rc_shed_total counter']
+        lines += [f'rc_shed_total{{route="{e["route"]}",reason="{e["reason"]}"}} {e["count"]}' for e in admitted['shed']]
+        lines += [
+            '# HELP rc_bulk_active Bulk requests being served.',
+            '# TYPE rc_bulk_active gauge',
+            f'rc_bulk_active {admitted["bulk_active"]}',
+            '# HELP rc_bulk_waiting Bulk requests waiting for a slot.',
+            '# TYPE rc_bulk_waiting gauge',
+            f'rc_bulk_waiting {admitted["bulk_waiting"]}',
+        ]
+
+        fleet = sessions.all()
+        lines += [
+            '# HELP rc_vehicle_sessions Vehicle sessions held by this process.',
+            '# TYPE rc_vehicle_sessions gauge',
+            f'rc_vehicle_sessions {len(fleet)}',
+            '# HELP rc_vehicle_sessions_evicted_total Idle vehicle sessions dropped.',
+            '# TYPE rc_vehicle_sessions_evicted_total counter',
+            f'rc_vehicle_sessions_evicted_total {sessions.evicted}',
+            '# HELP rc_vehicles_connected Vehicle sessions with a connected phone.',
+            '# TYPE rc_vehicles_connected gauge',
+            f'rc_vehicles_connected {sum(1 for session in fleet if session.is_connected)}',
+            '# HELP rc_failsafe_total Times throttle was cut for lack of control input.',
+            '# TYPE rc_failsafe_total counter',
+            f'rc_failsafe_total {sum(session.failsafes for session in fleet)}',
+            '# HELP rc_deadlines_pending Link-loss deadlines armed in the timer wheel.',
+            '# TYPE rc_deadlines_pending gauge',
+            f'rc_deadlines_pending {deadlines.pending()}',
+            '# HELP rc_commands_pending Commands waiting for a relay acknowledgement.',
+            '# TYPE rc_commands_pending gauge',
+            f'rc_commands_pending {sum(len(session.commands.pending) for session in fleet)}',
+            '# HELP rc_commands_total Commands by outcome.',
+            '# TYPE rc_commands_total counter',
+            f'rc_commands_total{{outcome="delivered"}} {sum(session.commands.delivered for session in fleet)}',
+            f'rc_commands_total{{outcome="expired"}} {sum(session.commands.expired for session in fleet)}',
+            '# HELP rc_phone_frames_superseded_total Control pushes replaced by a newer frame before they went out.',
+            '# TYPE rc_phone_frames_superseded_total counter',
+            f'rc_phone_frames_superseded_total {sum(session.sender.dropped_frames for session in fleet)}',
+            '# HELP rc_viewers Dashboard viewers on /api/watch.',
+            '# TYPE rc_viewers gauge',
+            f'rc_viewers {viewer_broadcaster.viewer_count()}',
+            '# HELP rc_viewers_evicted_total Viewers dropped for falling behind or going away.',
+            '# TYPE rc_viewers_evicted_total counter',
+            f'rc_viewers_evicted_total {viewer_broadcaster.evicted}',
+        ]
+        return ('\n'.join(lines) + '\n').encode()
+
+metrics = Metrics()
+
+def observe_origin(data):
+    """Record page-to-server latency for inputs the page stamped with its clock ('t', epoch ms)"""
+    origin = data.get('t')
+    if isinstance(origin, (int, float)):
+        metrics.observe('origin_to_ingest', time.time() - origin / 1000.0)
+
+class TelemetryBuffer:
+    """Fixed-capacity ring of telemetry samples, one array('d') column per numeric field
+
+    Every sample gets a cursor (its sequence number since startup) so readers
+    can ask for just what arrived after their last query. Fields missing from
+    a sample are stored as NaN.
+    """
+
+    def __init__(self, capacity, max_fields=32):
+        self.lock = threading.Lock()
+        self.capacity = capacity
+        self.max_fields = max_fields
+        self.times = array('d', [0.0]) * capacity
+        self.columns = {}           # field -> array('d')
+        self.count = 0              # samples ever appended; also the next cursor
+        self.last = None            # most recent sample as received
+
+    def append(self, sample, t=None):
+        t = time.time() if t is None else t
+        values = dict(numeric_fields(sample)) if isinstance(sample, dict) else {}
+        with self.lock:
+            for name in values:
+                if name not in self.columns and len(self.columns) < self.max_fields:
+                    self.columns[name] = array('d', [NAN]) * self.capacity
+            i = self.count % self.capacity
+            self.times[i] = t
+            for name, column in self.columns.items():
+                column[i] = values.get(name, NAN)
+            self.count += 1
+            self.last = sample
+
+    def window(self, column, start, end):
+        """Copy cursors [start, end) out of a ring column"""
+        n = end - start
+        i = start % self.capacity
+        if i + n <= self.capacity:
+            return column[i:i + n]
+        return column[i:] + column[:i + n - self.capacity]
+
+    def query(self, since=None, fields=None, bucket=None):
+        """Samples after cursor `since`, optionally reduced to min/max/mean per `bucket` seconds"""
+        with self.lock:
+            end = self.count
+            oldest = max(0, end - self.capacity)
+            start = oldest if since is None else min(max(since, oldest), end)
+            names = list(self.columns) if fields is None else [name for name in fields if name in self.columns]
+            times = self.window(self.times, start, end)
+            columns = {name: self.window(self.columns[name], start, end) for name in names}
+
+        result = {
+            'cursor': end,
+            'oldest': oldest,
+            'missed': max(0, oldest - since) if since is not None else 0,
+            'count': len(times),
+        }
+        if bucket:
+            result['bucket'] = bucket
+            result['t'], result['fields'] = downsample(times, columns, bucket)
+        else:
+            result['t'] = times.tolist()
+            result['fields'] = {name: [None if v != v else v for v in column] for name, column in columns.items()}
+        return result
+
+NAN = float('nan')
+
+def numeric_fields(sample, prefix=''):
+    """Yield (name, float) for every finite number in a telemetry dict; nested dicts become 'outer.inner'"""
+    for key, value in sample.items():
+        name = prefix + str(key)
+        if isinstance(value, (bool, int, float)):
+            try:
+                value = float(value)
+            except OverflowError:
+                # JSON integers have no size limit; one too big for a double is not a reading
+                continue
+            if math.isfinite(value):
+                yield name, value
+        elif isinstance(value, dict):
+            yield from numeric_fields(value, name + '.')
+
+def downsample(times, columns, width):
+    """Group samples into `width`-second buckets; returns bucket start times and min/max/mean per field"""
+    bucket_times = []
+    stats = {name: {'min': [], 'max': [], 'mean': []} for name in columns}
+    total = len(times)
+    i = 0
+    while i < total:
+        bucket = math.floor(times[i] / width)
+        j = i + 1
+        while j < total and math.floor(times[j] / width) == bucket:
+            j += 1
+        bucket_times.append(bucket * width)
+        for name, column in columns.items():
+            values = [v for v in column[i:j] if v == v]
+            field = stats[name]
+            field['min'].append(min(values) if values else None)
+            field['max'].append(max(values) if values else None)
+            field['mean'].append(sum(values) / len(values) if values else None)
+        i = j
+    return bucket_times, stats
+
+class DeadlineScheduler:
+    """Hashed timer wheel for link-loss deadlines, run from a single thread
+
+    A deadline lives in the slot of the tick it falls due on, so arming,
+    re-arming and cancelling one are a few dict operations no matter how
+    many are pending; refreshing one on every control input costs next to
+    nothing. Each tick the thread only looks at the slots it passed, and
+    entries a full turn or more away stay put until their turn comes round.
+    Callbacks run on the scheduler thread, up to one tick late.
+    """
+
+    def __init__(self, tick, slots=512):
+        self.tick = tick
+        self.lock = threading.Lock()
+        self.wheel = [{} for _ in range(slots)]    # slot -> {key: (due tick, callback, args)}
+        self.due = {}                               # key -> due tick
+        self.cursor = self.now_tick()               # last tick whose slot was run
+        self.fired = 0
+        self.thread = None
+
+    def now_tick(self):
+        return int(time.monotonic() / self.tick)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='deadlines', daemon=True)
+        self.thread.start()
+
+    def arm(self, key, delay, callback, *args):
+        """Call callback(*args) `delay` seconds from now, replacing any deadline already under `key`"""
+        due = math.ceil((time.monotonic() + delay) / self.tick)
+        with self.lock:
+            previous = self.due.get(key)
+            if previous is not None:
+                self.wheel[previous % len(self.wheel)].pop(key, None)
+            # Never land in a slot the thread has already passed this turn
+            due = max(due, self.cursor + 1)
+            self.wheel[due % len(self.wheel)][key] = (due, callback, args)
+            self.due[key] = due
+
+    def cancel(self, key):
+        with self.lock:
+            due = self.due.pop(key, None)
+            if due is not None:
+                self.wheel[due % len(self.wheel)].pop(key, None)
+
+    def pending(self):
+        return len(self.due)
+
+    def run(self):
+        while True:
+            time.sleep(max(0.0, (self.cursor + 1) * self.tick - time.monotonic()))
+            now = self.now_tick()
+            expired = []
+            with self.lock:
+                # After a stall, one full turn visits every slot
+                for tick in range(max(self.cursor + 1, now - len(self.wheel) + 1), now + 1):
+                    slot = self.wheel[tick % len(self.wheel)]
+                    if not slot:
+                        continue
+                    for key, entry in list(slot.items()):
+                        if entry[0] <= now:
+                            del slot[key]
+                            del self.due[key]
+                            expired.append(entry)
+                self.cursor = now
+            for _, callback, args in expired:
+                self.fired += 1
+                try:
+                    callback(*args)
+                except Exception as e:
+                    metrics.count_error('deadline')
+                    print(f"Deadline callback failed: {e}")
+
+deadlines = DeadlineScheduler(DEADLINE_TICK)
+
+VEHICLE_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,32}')
+VEHICLE_PATH = re.compile(r'/v/([A-Za-z0-9_-]{1,32})(/.*)?')
+
+# Directory for per-vehicle flight log subdirectories; main() sets it unless replaying
+flight_log_dir = None
+
+class VehicleSession:
+    """Everything one aircraft and its relay own: controls, phone link, outbound queue and telemetry
+
+    Sessions never share locks, so a busy vehicle does not hold up the rest
+    of the fleet. `lock` guards the phone link fields; controls, the feed,
+    the sender and the telemetry ring each lock themselves.
+    """
+
+    def __init__(self, vehicle_id):
+        self.vehicle_id = vehicle_id
+        self.lock = threading.Lock()
+        self.phone_addr = None
+        self.phone_last_seen = 0
+        self.is_connected = False
+        self.controls = RCControls()
+        self.shaper = InputShaper(shaping_profile, DEADLINE_TICK)
+        self.commands = CommandQueue(MAX_PENDING_COMMANDS, COMMAND_TTL)
+        self.feed = ControlFeed(self.controls, self.commands)
+        self.sender = PhoneSender(vehicle_id)
+        self.telemetry = TelemetryBuffer(TELEMETRY_CAPACITY)
+        self.status_cache = (None, None)
+        self.last_input = 0.0                       # monotonic time of the last control input
+        self.last_active = time.monotonic()         # last relay keep-alive or control input, for eviction
+        self.failsafes = 0
+        self.recent_frames = deque(maxlen=256)     # (version, updated_at) for relay timing reports
+        self.flight_log = None
+        if flight_log_dir:
+            self.flight_log = FlightLog(os.path.join(flight_log_dir, vehicle_id), FLIGHT_LOG_SEGMENT_MB * 1024 * 1024)
+
+    def phone_seen(self, addr):
+        """Record a relay keep-alive from addr; returns whether the phone was already connected"""
+        with self.lock:
+            previous = self.phone_addr
+            was_connected = self.is_connected
+            self.phone_addr = addr
+            self.phone_last_seen = time.time()
+            self.last_active = time.monotonic()
+            self.is_connected = True
+        if previous and previous[0] != addr[0]:
+            phone_pool.close_host((previous[0], PHONE_HTTP_PORT))
+        deadlines.arm(('phone', self.vehicle_id), PHONE_TIMEOUT, self.phone_lost)
+        return was_connected
+
+    def phone_lost(self):
+        """Deadline callback: the relay missed its keep-alives, so stop treating the phone as reachable"""
+        with self.lock:
+            if not self.is_connected or time.time() - self.phone_last_seen < PHONE_TIMEOUT:
+                return
+            addr = self.phone_addr
+            self.phone_addr = None
+            self.is_connected = False
+        if addr:
+            phone_pool.close_host((addr[0], PHONE_HTTP_PORT))
+            print(f"✗ Phone {addr[0]} timed out ({self.vehicle_id})")
+        viewer_broadcaster.publish(self)
+
+    def apply_input(self, axes, **switches):
+        """Shape raw axis input and apply it with any switch changes in one update; returns the frame"""
+        outputs, settling = self.shaper.shape(axes)
+        frame = self.controls.apply(**switches, **outputs)
+        if settling:
+            deadlines.arm(('slew', self.vehicle_id), DEADLINE_TICK, self.settle)
+        return frame
+
+    def settle(self):
+        """Deadline callback: move rate-limited outputs another step toward their targets"""
+        outputs, settling = self.shaper.shape({})
+        before = self.controls.snapshot
+        frame = self.controls.apply(**outputs)
+        if settling:
+            deadlines.arm(('slew', self.vehicle_id), DEADLINE_TICK, self.settle)
+        if frame is not before:
+            controls_changed(self)
+
+    def input_seen(self):
+        """Note a live control input; restarts the failsafe deadline"""
+        self.last_active = time.monotonic()
+        if FAILSAFE_TIMEOUT > 0:
+            self.last_input = self.last_active
+            deadlines.arm(('input', self.vehicle_id), FAILSAFE_TIMEOUT, self.input_lost)
+
+    def input_lost(self):
+        """Deadline callback: no input for FAILSAFE_TIMEOUT"""
+        if time.monotonic() - self.last_input < FAILSAFE_TIMEOUT:
+            # An input raced the deadline and won
+            return
+        self.engage_failsafe(f'No control input for {FAILSAFE_TIMEOUT:g}s')
+
+    def engage_failsafe(self, reason):
+        """Cut throttle to FAILSAFE_THROTTLE and tell everyone at once"""
+        deadlines.cancel(('input', self.vehicle_id))
+        # The failsafe bypasses shaping and stops any slew still under way
+        deadlines.cancel(('slew', self.vehicle_id))
+        self.shaper.hold('throttle', FAILSAFE_THROTTLE)
+        before = self.controls.snapshot
+        frame = self.controls.apply(throttle=FAILSAFE_THROTTLE)
+        if frame is before:
+            return
+        self.failsafes += 1
+        print(f"⚠️  {reason} on '{self.vehicle_id}': throttle {before.throttle:.2f} -> {frame.throttle:.2f}")
+        controls_changed(self)
+
+    def queue_command(self, command):
+        """Queue a command for the relay and wake its stream; returns the command ID or None if full"""
+        command_id = self.commands.submit(command)
+        if command_id is not None:
+            deadlines.arm(('command', self.vehicle_id, command_id), COMMAND_TTL, self.command_expired, command_id)
+            self.feed.publish()
+        return command_id
+
+    def acknowledge_commands(self, ids):
+        for command_id in ids:
+            deadlines.cancel(('command', self.vehicle_id, command_id))
+        if self.commands.acknowledge(ids):
+            print(f"✓ Relay acknowledged command(s) {', '.join(map(command_ref, ids))} ({self.vehicle_id})")
+
+    def command_expired(self, command_id):
+        """Deadline callback: the relay never acknowledged a command"""
+        command = self.commands.expire(command_id)
+        if command is not None:
+            metrics.count_error('command_expired')
+            print(f"✗ Command {command_ref(command_id)} '{command}' expired unacknowledged ({self.vehicle_id})")
+
+    def remember_frame(self, frame):
+        if not self.recent_frames or self.recent_frames[-1][0] != frame.version:
+            self.recent_frames.append((frame.version, frame.updated_at))
+
+    def frame_time(self, version):
+        """Wall time a recent frame version was made, or None once it has aged out"""
+        for known, updated_at in reversed(self.recent_frames):
+            if known == version:
+                return updated_at
+        return None
+
+    def summary(self):
+        phone_addr = self.phone_addr
+        return {
+            'id': self.vehicle_id,
+            'connected': self.is_connected,
+            'phone_ip': phone_addr[0] if phone_addr else None,
+            'last_seen': self.phone_last_seen or None,
+            'controls_version': self.controls.version,
+            'failsafes': self.failsafes,
+            'commands_pending': len(self.commands.pending),
+        }
+
+    def close(self):
+        deadlines.cancel(('phone', self.vehicle_id))
+        deadlines.cancel(('input', self.vehicle_id))
+        deadlines.cancel(('slew', self.vehicle_id))
+        deadlines.cancel(('evict', self.vehicle_id))
+        self.sender.stop()
+        with self.lock:
+            addr, self.phone_addr = self.phone_addr, None
+            self.is_connected = False
+        if addr:
+            phone_pool.close_host((addr[0], PHONE_HTTP_PORT))
+        if self.flight_log is not None:
+            self.flight_log.close()
+
+class SessionRegistry:
+    """Vehicle sessions by ID; lookups are lock-free, the lock is only taken to create or drop one
+
+    Only a relay registering or a control input opens a session; reads
+    just look one up, so stray URLs cannot fill the registry. Sessions
+    other than the default one are dropped once they sit idle for
+    `idle_timeout`, checked from the deadline wheel.
+    """
+
+    def __init__(self, max_sessions, idle_timeout):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.evicted = 0
+
+    def get(self, vehicle_id):
+        """Return the vehicle's session if it exists, else None"""
+        return self.sessions.get(vehicle_id)
+
+    def open(self, vehicle_id):
+        """Return the vehicle's session, creating it on first use; None once the registry is full"""
+        session = self.sessions.get(vehicle_id)
+        if session is not None:
+            session.last_active = time.monotonic()
+            return session
+        if not VEHICLE_ID_PATTERN.fullmatch(vehicle_id):
+            raise ValueError(f'invalid vehicle id {vehicle_id!r}')
+        with self.lock:
+            session = self.sessions.get(vehicle_id)
+            if session is None:
+                if len(self.sessions) >= self.max_sessions:
+                    return None
+                session = VehicleSession(vehicle_id)
+                # Publish a new dict so readers never see one mid-resize
+                self.sessions = dict(self.sessions, **{vehicle_id: session})
+                print(f"✓ Vehicle session '{vehicle_id}' created")
+                if vehicle_id != DEFAULT_VEHICLE:
+                    deadlines.arm(('evict', vehicle_id), self.idle_timeout, self.evict_if_idle, vehicle_id)
+            return session
+
+    def evict_if_idle(self, vehicle_id):
+        """Deadline callback: drop a session nobody has used for idle_timeout, or check again later"""
+        session = self.sessions.get(vehicle_id)
+        if session is None:
+            return
+        idle = time.monotonic() - session.last_active
+        if session.is_connected or viewer_broadcaster.watched.get(vehicle_id):
+            idle = 0.0
+        if idle < self.idle_timeout:
+            deadlines.arm(('evict', vehicle_id), self.idle_timeout - idle, self.evict_if_idle, vehicle_id)
+            return
+        with self.lock:
+            remaining = dict(self.sessions)
+            del remaining[vehicle_id]
+            self.sessions = remaining
+            self.evicted += 1
+        session.close()
+        print(f"✓ Vehicle session '{vehicle_id}' dropped after {idle:.0f}s idle")
+
+    def all(self):
+        return list(self.sessions.values())
+
+    def close(self):
+        for session in self.all():
+            session.close()
+
+sessions = SessionRegistry(MAX_SESSIONS, SESSION_IDLE_TIMEOUT)
+
+def split_vehicle_path(path):
+    """Split a request path into (vehicle_id, route): /v/<id>/... names a vehicle, anything else the default one"""
+    match = VEHICLE_PATH.fullmatch(path)
+    if match is None:
+        return DEFAULT_VEHICLE, path
+    return match.group(1), match.group(2) or '/'
+
+def ingest_telemetry(session, raw, source='replay'):
+    """Buffer and record one telemetry payload (JSON bytes) for a vehicle"""
+    try:
+        sample = json.loads(raw)
+    except ValueError:
+        print(f"📨 Raw telemetry from {source}: {bytes(raw[:200]).decode(errors='replace')}")
+        return
+    session.telemetry.append(sample)
+    viewer_broadcaster.publish(session)
+    if session.flight_log is not None:
+        session.flight_log.append(RECORD_TELEMETRY, bytes(raw))
+
+def status_body(session):
+    """Return (etag, body) for a vehicle's /api/status, rebuilt only when something in it changed"""
+    controls_version, controls_json = session.controls.encode_with_version('json')
+    phone_addr = session.phone_addr
+    key = (
+        controls_version,
+        session.is_connected,
+        phone_addr[0] if phone_addr else None,
+        phone_pool.generation,
+        udp_endpoint.subscriber_count(session.vehicle_id) if udp_endpoint else 0,
+        session.telemetry.count,
+    )
+    cached_key, cached = session.status_cache
+    if cached_key == key:
+        return cached
+
+    status_data = {
+        'vehicle': session.vehicle_id,
+        'connected': key[1],
+        'phone_ip': key[2],
+        'telemetry': session.telemetry.last,
+        'phone_link': phone_pool.stats(key[2]) if key[2] else {},
+        'udp_subscribers': key[4]
+    }
+    # Splice in the cached controls JSON rather than decoding and re-encoding it
+    body = json.dumps(status_data).encode()
+    body = body[:-1] + b', "rc_controls": ' + controls_json + b'}'
+    etag = f'"{BOOT_ID}-s' + hashlib.sha1(repr((session.vehicle_id,) + key).encode()).hexdigest()[:16] + '"'
+    session.status_cache = (key, (etag, body))
+    return etag, body
+
+class Viewer:
+    __slots__ = ('sock', 'vehicle_id', 'pending')
+
+    def __init__(self, sock, vehicle_id):
+        self.sock = sock
+        self.vehicle_id = vehicle_id
+        self.pending = bytearray()      # bytes the socket would not take yet
+
+class ViewerBroadcaster:
+    """Fans each vehicle's status out to dashboard viewers over SSE from a single thread
+
+    Handlers hand the viewer's socket over once the response headers are out,
+    so viewers do not hold a worker. A status change is encoded once per
+    vehicle and the same bytes go to every viewer with non-blocking sends;
+    bursts of changes collapse to one update per `min_interval`. A viewer
+    whose unsent backlog passes `max_backlog` is dropped, not buffered.
+    """
+
+    HEARTBEAT = b': heartbeat\n\n'
+
+    def __init__(self, max_viewers, min_interval, heartbeat, max_backlog):
+        self.max_viewers = max_viewers
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+        self.max_backlog = max_backlog
+        self.lock = threading.Lock()
+        self.count = 0              # viewers admitted, including ones still joining
+        self.joining = []           # (vehicle_id, sock) handed over but not yet registered
+        self.dirty = set()          # vehicle IDs with an unsent status change
+        self.watched = {}           # vehicle_id -> set of Viewer
+        self.last_sent = {}         # vehicle_id -> monotonic time of its last fan-out
+        self.evicted = 0
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='viewer-broadcast', daemon=True)
+        self.thread.start()
+
+    def reserve(self):
+        """Claim a viewer slot before answering the request; False when full"""
+        with self.lock:
+            if self.thread is None or self.count >= self.max_viewers:
+                return False
+            self.count += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.count -= 1
+
+    def add(self, session, sock):
+        """Take ownership of a viewer socket whose SSE headers have been sent"""
+        with self.lock:
+            self.joining.append((session.vehicle_id, sock))
+        self.wake()
+
+    def publish(self, session):
+        # Cheap enough for the control path: no lock or syscall unless someone is watching
+        vehicle_id = session.vehicle_id
+        if not self.watched.get(vehicle_id) or vehicle_id in self.dirty:
+            return
+        with self.lock:
+            self.dirty.add(vehicle_id)
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wake_w.send(b'\0')
+        except OSError:
+            # Buffer full means a wake-up is already pending
+            pass
+
+    def run(self):
+        next_heartbeat = time.monotonic() + self.heartbeat
+        while True:
+            timeout = max(0.0, next_heartbeat - time.monotonic())
+            if self.dirty:
+                timeout = min(timeout, self.min_interval)
+            for key, mask in self.selector.select(timeout):
+                if key.fileobj is self.wake_r:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                viewer = key.data
+                if mask & selectors.EVENT_READ:
+                    # SSE viewers never send; readable means the peer closed or misbehaved
+                    self.evict(viewer)
+                elif mask & selectors.EVENT_WRITE:
+                    self.flush(viewer)
+            self.admit()
+            self.fan_out()
+            if time.monotonic() >= next_heartbeat:
+                for viewers in list(self.watched.values()):
+                    for viewer in list(viewers):
+                        if not viewer.pending:
+                            self.write(viewer, self.HEARTBEAT)
+                next_heartbeat = time.monotonic() + self.heartbeat
+
+    def admit(self):
+        with self.lock:
+            joining, self.joining = self.joining, []
+        for vehicle_id, sock in joining:
+            sock.setblocking(False)
+            viewer = Viewer(sock, vehicle_id)
+            self.selector.register(sock, selectors.EVENT_READ, viewer)
+            self.watched.setdefault(vehicle_id, set()).add(viewer)
+            self.write(viewer, self.encode(vehicle_id))
+
+    def fan_out(self):
+        now = time.monotonic()
+        with self.lock:
+            ready = [v for v in self.dirty if now - self.last_sent.get(v, 0.0) >= self.min_interval]
+            self.dirty.difference_update(ready)
+        for vehicle_id in ready:
+            self.last_sent[vehicle_id] = now
+            viewers = self.watched.get(vehicle_id)
+            if not viewers:
+                continue
+            message = self.encode(vehicle_id)
+            for viewer in list(viewers):
+                self.write(viewer, message)
+
+    def encode(self, vehicle_id):
+        session = sessions.get(vehicle_id)
+        if session is None:
+            # Dropped between being watched and this update
+            return self.HEARTBEAT
+        _, body = status_body(session)
+        return b'event: status\ndata: ' + body + b'\n\n'
+
+    def write(self, viewer, data):
+        if not viewer.pending:
+            try:
+                sent = viewer.sock.send(data)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.evict(viewer)
+                return
+            if sent == len(data):
+                return
+            data = data[sent:]
+            self.selector.modify(viewer.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, viewer)
+        viewer.pending += data
+        if len(viewer.pending) > self.max_backlog:
+            print(f"👀 Dropping slow viewer of '{viewer.vehicle_id}' ({len(viewer.pending)} bytes behind)")
+            self.evict(viewer)
+
+    def flush(self, viewer):
+        try:
+            sent = viewer.sock.send(viewer.pending)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.evict(viewer)
+            return
+        del viewer.pending[:sent]
+        if not viewer.pending:
+            self.selector.modify(viewer.sock, selectors.EVENT_READ, viewer)
+
+    def evict(self, viewer):
+        viewers = self.watched.get(viewer.vehicle_id)
+        if viewers is None or viewer not in viewers:
+            return
+        viewers.discard(viewer)
+        self.selector.unregister(viewer.sock)
+        viewer.sock.close()
+        self.evicted += 1
+        self.release()
+
+    def viewer_count(self):
+        return sum(len(viewers) for viewers in list(self.watched.values()))
+
+viewer_broadcaster = ViewerBroadcaster(MAX_VIEWERS, VIEWER_MIN_INTERVAL, VIEWER_HEARTBEAT, VIEWER_MAX_BACKLOG)
+
+# Routes counted by name in rc_http_requests_total; anything else is 'other'
+METRIC_ROUTES = {
+    '/', '/api/status', '/api/control', '/api/controls', '/api/arm', '/api/flightmode', '/api/command',
+    '/phone/keepalive', '/phone/frame_ack', '/api/get_controls', '/ws/controls', '/api/stream_controls',
+    '/api/telemetry', '/phone/telemetry', '/api/watch', '/metrics', '/api/vehicles',
+}
+
+# Routes that may create a vehicle session: relay registration and control writes.
+# Everything else only sees vehicles that already exist
+SESSION_OPENING_ROUTES = {
+    '/phone/keepalive', '/api/control', '/api/controls', '/api/arm', '/api/flightmode', '/ws/controls',
+}
+
+# Flight-critical routes: never queued behind anything else. Every other route is bulk
+CONTROL_ROUTES = {
+    '/api/control', '/api/controls', '/api/arm', '/api/flightmode', '/api/get_controls', '/ws/controls',
+    '/api/stream_controls', '/phone/keepalive', '/phone/frame_ack', '/phone/telemetry',
+}
+
+class AdmissionControl:
+    """Per-client token buckets plus a capped lane for bulk requests
+
+    Control-path requests only pass their client's bucket. Bulk requests
+    (the page, status, commands, history) also need one of `bulk_slots`;
+    up to `bulk_queue` of them may wait `bulk_wait` seconds for one, the
+    rest are shed. Bulk traffic therefore never holds more than
+    bulk_slots + bulk_queue workers, leaving the rest for control frames.
+    """
+
+    def __init__(self, limits, bulk_slots, bulk_queue, bulk_wait, max_clients=4096):
+        self.limits = limits                # lane -> (rate per s, burst)
+        self.bulk_slots = bulk_slots
+        self.bulk_queue = bulk_queue
+        self.bulk_wait = bulk_wait
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.bulk_free = threading.Condition(self.lock)
+        self.buckets = {}                   # (client, lane) -> [tokens, last refill]
+        self.bulk_active = 0
+        self.bulk_waiting = 0
+        self.shed = {}                      # (route, reason) -> count
+        self.recent_shed = deque(maxlen=50)
+
+    def take_token(self, client, lane, route):
+        """Spend one token from the client's bucket; returns None, or seconds to wait before retrying"""
+        rate, burst = self.limits[lane]
+        if not rate:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get((client, lane))
+            if bucket is None:
+                if len(self.buckets) >= self.max_clients:
+                    self.prune(now)
+                bucket = self.buckets[client, lane] = [burst, now]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return None
+            self.record_shed(client, route, 'rate_limit')
+            return (1 - bucket[0]) / rate
+
+    def prune(self, now):
+        # Buckets idle long enough to have refilled carry no state worth keeping
+        for key in [key for key, (_, updated) in self.buckets.items() if now - updated > 60]:
+            del self.buckets[key]
+
+    def enter_bulk(self, client, route):
+        """Wait briefly for a bulk slot; False if the request should be shed"""
+        with self.lock:
+            if self.bulk_active >= self.bulk_slots:
+                if self.bulk_waiting >= self.bulk_queue:
+                    self.record_shed(client, route, 'bulk_queue_full')
+                    return False
+                self.bulk_waiting += 1
+                try:
+                    admitted = self.bulk_free.wait_for(lambda: self.bulk_active < self.bulk_slots, self.bulk_wait)
+                finally:
+                    self.bulk_waiting -= 1
+                if not admitted:
+                    self.record_shed(client, route, 'bulk_timeout')
+                    return False
+            self.bulk_active += 1
+            return True
+
+    def leave_bulk(self):
+        with self.lock:
+            self.bulk_active -= 1
+            self.bulk_free.notify()
+
+    def record_shed(self, client, route, reason):
+        # Called with the lock held
+        self.shed[route, reason] = self.shed.get((route, reason), 0) + 1
+        self.recent_shed.append({'time': time.time(), 'client': client, 'route': route, 'reason': reason})
+
+    def stats(self):
+        with self.lock:
+            return {
+                'bulk_active': self.bulk_active,
+                'bulk_waiting': self.bulk_waiting,
+                'clients': len(self.buckets),
+                'shed': [{'route': route, 'reason': reason, 'count': n} for (route, reason), n in sorted(self.shed.items())],
+                'recent_shed': list(self.recent_shed),
+            }
+
+admission = AdmissionControl(
+    {'control': (CONTROL_RATE, CONTROL_BURST), 'bulk': (BULK_RATE, BULK_BURST)},
+    BULK_SLOTS, BULK_QUEUE, BULK_QUEUE_WAIT,
+)
+
+# The control page is the same for every vehicle (scripts derive their API prefix from the URL),
+# so it is built and compressed once at startup
+CONTROL_PAGE = """<!DOCTYPE html>
 <html>
 <head>
     <title>RC Plane Control</title>
     <meta charset="utf-8">
     <style>
-        body {{ font-family: Arial, sans-serif; margin: 20px; background: #f0f0f0; }}
-        .container {{ max-width: 800px; margin: 0 auto; background: white; padding: 20px; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }}
-        .status {{ padding: 10px; margin: 10px 0; border-radius: 5px; }}
-        .connected {{ background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }}
-        .disconnected {{ background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }}
-        .controls {{ display: grid; grid-template-columns: 1fr 1fr; gap: 20px; margin: 20px 0; }}
-        .control-group {{ background: #f8f9fa; padding: 15px; border-radius: 5px; }}
-        .control-group h3 {{ margin-top: 0; color: #495057; }}
-        .slider {{ width: 100%; margin: 10px 0; }}
-        .button {{ background: #007bff; color: white; border: none; padding: 10px 20px; border-radius: 5px; cursor: pointer; margin: 5px; }}
-        .button:hover {{ background: #0056b3; }}
-        .button.danger {{ background: #dc3545; }}
-        .button.danger:hover {{ background: #c82333; }}
-        .button.success {{ background: #28a745; }}
-        .button.success:hover {{ background: #218838; }}
-        .value-display {{ font-weight: bold; color: #007bff; }}
-        .telemetry {{ background: #e9ecef; padding: 10px; border-radius: 5px; margin: 10px 0; }}
+        body { font-family: Arial, sans-serif; margin: 20px; background: #f0f0f0; }
+        .container { max-width: 800px; margin: 0 auto; background: white; padding: 20px; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+        .status { padding: 10px; margin: 10px 0; border-radius: 5px; }
+        .connected { background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }
+        .disconnected { background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }
+        .controls { display: grid; grid-template-columns: 1fr 1fr; gap: 20px; margin: 20px 0; }
+        .control-group { background: #f8f9fa; padding: 15px; border-radius: 5px; }
+        .control-group h3 { margin-top: 0; color: #495057; }
+        .slider { width: 100%; margin: 10px 0; }
+        .button { background: #007bff; color: white; border: none; padding: 10px 20px; border-radius: 5px; cursor: pointer; margin: 5px; }
+        .button:hover { background: #0056b3; }
+        .button.danger { background: #dc3545; }
+        .button.danger:hover { background: #c82333; }
+        .button.success { background: #28a745; }
+        .button.success:hover { background: #218838; }
+        .value-display { font-weight: bold; color: #007bff; }
+        .telemetry { background: #e9ecef; padding: 10px; border-radius: 5px; margin: 10px 0; }
     </style>
 </head>
 <body>
     <div class="container">
         <h1>🎮 RC Plane Control</h1>
         
-        <div class="status {'connected' if is_connected else 'disconnected'}">
-            <strong>Status:</strong> {'✓ Phone Connected' if is_connected else '❌ No Phone Connected'}
-            <br><small>Phone IP: {phone_addr[0] if phone_addr else 'None'}</small>
+        <div class="status disconnected" id="phone-status">
+            <strong>Vehicle:</strong> <span id="vehicle-id">-</span><br>
+            <strong>Status:</strong> <span id="connection">Loading...</span>
+            <br><small>Phone IP: <span id="phone-ip">None</span></small>
         </div>
         
         <div class="controls">
@@ -106,13 +1652,9 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
             
             <div class="control-group">
                 <h3>⚙️ System Controls</h3>
-                <button class="button {'success' if rc_controls.armed else 'danger'}" onclick="toggleArm()">
-                    {'🛑 DISARM' if rc_controls.armed else '🚀 ARM'}
-                </button>
+                <button class="button danger" id="arm-button" onclick="toggleArm()">🚀 ARM</button>
                 <br>
-                <button class="button" onclick="cycleFlightMode()">
-                    Flight Mode: {['MANUAL', 'STABILIZED', 'AUTO'][rc_controls.flight_mode]}
-                </button>
+                <button class="button" id="mode-button" onclick="cycleFlightMode()">Flight Mode: MANUAL</button>
                 <br>
                 <button class="button" onclick="sendCommand('test')">Test Command</button>
                 <button class="button" onclick="sendCommand('status')">Get Status</button>
@@ -121,7 +1663,7 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
         
         <div class="telemetry">
             <h3>📊 Current RC Values</h3>
-            <pre id="rc-values">{rc_controls.to_json()}</pre>
+            <pre id="rc-values">Loading...</pre>
         </div>
         
         <div class="telemetry">
@@ -131,42 +1673,126 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
     </div>
 
     <script>
-        function updateControl(control, value) {{
-            document.getElementById(control + '-val').textContent = value.toFixed(2);
-            fetch('/api/control', {{
+        // ===== Control channel: one WebSocket, falling back to POSTs while it is down =====
+        // Every call stays under the vehicle prefix the page was served from (/v/<id>/)
+        const BASE = location.pathname.replace(/[/]+$/, '');
+        // The socket is opened on the first control input, so pages that only watch never hold one
+        let controlSocket = null;
+        let socketPending = false;
+        let controlSeq = 0;
+
+        function connectControlSocket() {
+            socketPending = true;
+            const scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+            const ws = new WebSocket(scheme + location.host + BASE + '/ws/controls');
+            ws.onopen = () => {
+                controlSocket = ws;
+                socketPending = false;
+            };
+            ws.onclose = () => {
+                controlSocket = null;
+                // Reopen on a later input, giving a full server a moment first
+                setTimeout(() => { socketPending = false; }, 5000);
+            };
+        }
+
+        function sendControlFrame(frame, fallbackUrl) {
+            frame.t = Date.now(); // origin stamp for the server's latency histograms
+            if (controlSocket && controlSocket.readyState === WebSocket.OPEN) {
+                frame.seq = ++controlSeq;
+                controlSocket.send(JSON.stringify(frame));
+                return;
+            }
+            if (!socketPending) {
+                connectControlSocket();
+            }
+            fetch(fallbackUrl, {
                 method: 'POST',
-                headers: {{'Content-Type': 'application/json'}},
-                body: JSON.stringify({{control: control, value: value}})
-            }});
-        }}
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(frame)
+            }).catch(() => {});
+        }
+
+        // Keep an idle socket from hitting the server's read timeout. Only frames with stick
+        // values count as control input for the server's failsafe, so this does not
+        setInterval(() => {
+            if (controlSocket && controlSocket.readyState === WebSocket.OPEN) {
+                controlSocket.send('{}');
+            }
+        }, 10000);
+
+        // Axes this page has set with its sliders
+        const sliderAxes = new Set();
+
+        function updateControl(control, value) {
+            document.getElementById(control + '-val').textContent = value.toFixed(2);
+            sliderAxes.add(control);
+            sendControlFrame({control: control, value: value}, BASE + '/api/control');
+        }
+
+        // Sliders only send when they move, but the server cuts throttle after a couple of seconds
+        // without input. While the page is in view, repeat the slider positions well inside that window;
+        // a hidden tab or a closed page stops, and the failsafe takes over
+        setInterval(() => {
+            if (!sliderAxes.size || gamepadConnected || document.visibilityState !== 'visible') {
+                return;
+            }
+            const frame = {};
+            sliderAxes.forEach((axis) => { frame[axis] = document.getElementById(axis).value / 100; });
+            sendControlFrame(frame, BASE + '/api/controls');
+        }, 500);
         
-        function toggleArm() {{
-            fetch('/api/arm', {{method: 'POST'}});
-        }}
+        function toggleArm() {
+            fetch(BASE + '/api/arm', {method: 'POST'});
+        }
         
-        function cycleFlightMode() {{
-            fetch('/api/flightmode', {{method: 'POST'}});
-        }}
+        function cycleFlightMode() {
+            fetch(BASE + '/api/flightmode', {method: 'POST'});
+        }
         
-        function sendCommand(cmd) {{
-            fetch('/api/command', {{
+        function sendCommand(cmd) {
+            fetch(BASE + '/api/command', {
                 method: 'POST',
-                headers: {{'Content-Type': 'application/json'}},
-                body: JSON.stringify({{command: cmd}})
-            }});
-        }}
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({command: cmd})
+            });
+        }
         
-        // Auto-refresh status every 2 seconds
-        setInterval(() => {{
-            fetch('/api/status')
-                .then(response => response.json())
-                .then(data => {{
-                    document.getElementById('rc-values').textContent = JSON.stringify(data.rc_controls, null, 2);
-                    if (data.telemetry) {{
-                        document.getElementById('telemetry').textContent = JSON.stringify(data.telemetry, null, 2);
-                    }}
-                }});
-        }}, 2000);
+        const FLIGHT_MODES = ['MANUAL', 'STABILIZED', 'AUTO'];
+
+        function renderStatus(data) {
+            const status = document.getElementById('phone-status');
+            status.className = 'status ' + (data.connected ? 'connected' : 'disconnected');
+            document.getElementById('vehicle-id').textContent = data.vehicle;
+            document.getElementById('connection').textContent = data.connected ? '✓ Phone Connected' : '❌ No Phone Connected';
+            document.getElementById('phone-ip').textContent = data.phone_ip || 'None';
+            const armButton = document.getElementById('arm-button');
+            armButton.className = 'button ' + (data.rc_controls.armed ? 'success' : 'danger');
+            armButton.textContent = data.rc_controls.armed ? '🛑 DISARM' : '🚀 ARM';
+            document.getElementById('mode-button').textContent = 'Flight Mode: ' + FLIGHT_MODES[data.rc_controls.flight_mode];
+            document.getElementById('rc-values').textContent = JSON.stringify(data.rc_controls, null, 2);
+            if (data.telemetry) {
+                document.getElementById('telemetry').textContent = JSON.stringify(data.telemetry, null, 2);
+            }
+        }
+
+        // The page itself is static: fetch the live state once, then follow pushed updates,
+        // polling every 2 seconds if the server turns the push channel away
+        fetch(BASE + '/api/status')
+            .then(response => response.json())
+            .then(renderStatus);
+        let statusPoll = null;
+        const statusSource = new EventSource(BASE + '/api/watch');
+        statusSource.addEventListener('status', (e) => renderStatus(JSON.parse(e.data)));
+        statusSource.onerror = () => {
+            if (statusSource.readyState === EventSource.CLOSED && !statusPoll) {
+                statusPoll = setInterval(() => {
+                    fetch(BASE + '/api/status')
+                        .then(response => response.json())
+                        .then(renderStatus);
+                }, 2000);
+            }
+        };
         // ===== Gamepad support (Xbox controller via browser) =====
         let prevButtons = {};
         let gamepadConnected = false;
@@ -182,11 +1808,6 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
             console.log('Gamepad disconnected');
         });
 
-        function applyDeadzone(value, dz = 0.06) {
-            if (Math.abs(value) < dz) return 0;
-            return value;
-        }
-
         function pollGamepadAndSend() {
             const now = performance.now();
             if (!gamepadConnected || (now - lastSent) < sendIntervalMs) {
@@ -201,11 +1822,11 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
                 return;
             }
 
-            // Xbox standard mapping
-            const lsx = applyDeadzone(gp.axes[0] || 0); // rudder
-            const lsy = applyDeadzone(gp.axes[1] || 0); // throttle (invert)
-            const rsx = applyDeadzone(gp.axes[2] || 0); // aileron
-            const rsy = applyDeadzone(gp.axes[3] || 0); // elevator
+            // Xbox standard mapping, sent raw: the server applies deadzone and curves for every input source
+            const lsx = gp.axes[0] || 0; // rudder
+            const lsy = gp.axes[1] || 0; // throttle (invert)
+            const rsx = gp.axes[2] || 0; // aileron
+            const rsy = gp.axes[3] || 0; // elevator
 
             const throttle = (1 - lsy) / 2; // map -1..1 to 1..0 then 0..1
             const rudder = lsx;
@@ -224,11 +1845,7 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
 
             const payload = { throttle, rudder, elevator, aileron, toggleArm, cycleMode };
 
-            fetch('/api/controls', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payload)
-            }).catch(() => {});
+            sendControlFrame(payload, BASE + '/api/controls');
 
             // Update UI values
             const setVal = (id, v) => {
@@ -248,46 +1865,136 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
     </script>
 </body>
 </html>
-            """
-            self.wfile.write(html.encode())
-            
-        elif path == '/api/status':
-            # API endpoint for status
+"""
+CONTROL_PAGE_BODY = CONTROL_PAGE.encode()
+CONTROL_PAGE_GZIP = gzip.compress(CONTROL_PAGE_BODY, 9, mtime=0)
+CONTROL_PAGE_ETAG = '"page-' + hashlib.sha1(CONTROL_PAGE_BODY).hexdigest()[:16] + '"'
+
+def accepts_gzip(accept_encoding):
+    """True if an Accept-Encoding header allows gzip"""
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+def wants_binary_frame(accept, query):
+    """HTTP clients opt into binary frames with ?format=binary or an Accept header; JSON stays the default"""
+    if query.get('format', [''])[0] == 'binary':
+        return True
+    return FRAME_CONTENT_TYPE in accept or 'application/octet-stream' in accept
+
+class RCHTTPHandler(BaseHTTPRequestHandler):
+    timeout = REQUEST_TIMEOUT
+
+    def do_GET(self):
+        parsed_path = urllib.parse.urlparse(self.path)
+        # /v/<id>/... routes address one vehicle; unprefixed routes are the default vehicle
+        vehicle_id, path = split_vehicle_path(parsed_path.path)
+        self.route = path if path in METRIC_ROUTES else 'other'
+
+        client = self.client_key()
+        retry_after = admission.take_token(client, 'control' if path in CONTROL_ROUTES else 'bulk', self.route)
+        if retry_after is not None:
+            self.send_shed(429, retry_after, 'Rate limit exceeded')
+            return
+        if path in CONTROL_ROUTES:
+            self.dispatch(parsed_path, vehicle_id, path)
+            return
+        if not admission.enter_bulk(client, self.route):
+            self.send_shed(503, 1, 'Busy serving flight traffic, retry shortly')
+            return
+        try:
+            self.dispatch(parsed_path, vehicle_id, path)
+        finally:
+            admission.leave_bulk()
+
+    # The browser and relay POST to the same routes
+    do_POST = do_GET
+
+    def client_key(self):
+        forwarded = self.headers.get('X-Forwarded-For') if TRUST_PROXY else None
+        if forwarded:
+            # Earlier entries are whatever the client sent; the last one is the address our proxy saw
+            return forwarded.split(',')[-1].strip()
+        return self.client_address[0]
+
+    def send_shed(self, code, retry_after, message):
+        body = json.dumps({'status': 'error', 'message': message}).encode()
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Retry-After', str(max(1, math.ceil(retry_after))))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def dispatch(self, parsed_path, vehicle_id, path):
+        if parsed_path.path == '/metrics':
+            # Prometheus scrape target
+            body = metrics.render()
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if parsed_path.path == '/api/vehicles':
+            # Fleet overview across every vehicle session, the input shaping in force and what admission control has shed
+            body = json.dumps({
+                'vehicles': [session.summary() for session in sessions.all()],
+                'shaping': shaping_profile.settings,
+                'admission': admission.stats(),
+            }).encode()
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            
-            status_data = {
-                'connected': is_connected,
-                'phone_ip': phone_addr[0] if phone_addr else None,
-                'rc_controls': json.loads(rc_controls.to_json()),
-                'telemetry': None  # TODO: Add telemetry
-            }
-            self.wfile.write(json.dumps(status_data).encode())
+            self.wfile.write(body)
+            return
+
+        if path == '/':
+            # Static page shell; live state comes from /api/status and /api/watch
+            self.send_page()
+            return
+
+        if path in SESSION_OPENING_ROUTES:
+            session = sessions.open(vehicle_id)
+            if session is None:
+                self.send_error(503, 'Vehicle session limit reached')
+                return
+        else:
+            session = sessions.get(vehicle_id)
+            if session is None:
+                self.route = 'other'
+                self.send_error(404, 'Unknown vehicle; it appears once its relay or a control input does')
+                return
+
+        if path == '/api/status':
+            # API endpoint for status
+            etag, body = status_body(session)
+            self.send_cacheable(body, 'application/json', etag)
             
         elif path == '/api/control':
             # API endpoint for control updates
+            try:
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                received = time.perf_counter()
+                data = json.loads(post_data.decode())
+                observe_origin(data)
+                apply_single_control(session, data['control'], data['value'])
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                metrics.count_error('bad_control')
+                self.send_error(400, f'Bad control update: {e}')
+                return
+
+            # Wake streams and send to phone
+            controls_changed(session, received)
+
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
-            
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode())
-            
-            if data['control'] == 'throttle':
-                rc_controls.throttle = data['value']
-            elif data['control'] == 'rudder':
-                rc_controls.rudder = data['value']
-            elif data['control'] == 'elevator':
-                rc_controls.elevator = data['value']
-            elif data['control'] == 'aileron':
-                rc_controls.aileron = data['value']
-                
-            # Send to phone
-            if phone_addr:
-                send_rc_controls_to_phone()
-                
             self.wfile.write(json.dumps({'status': 'ok'}).encode())
 
         elif path == '/api/controls':
@@ -299,24 +2006,18 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
             try:
                 content_length = int(self.headers.get('Content-Length', 0))
                 post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+                received = time.perf_counter()
                 data = json.loads(post_data.decode())
+                observe_origin(data)
 
-                rc_controls.throttle = float(data.get('throttle', rc_controls.throttle))
-                rc_controls.rudder = float(data.get('rudder', rc_controls.rudder))
-                rc_controls.elevator = float(data.get('elevator', rc_controls.elevator))
-                rc_controls.aileron = float(data.get('aileron', rc_controls.aileron))
-
-                if data.get('toggleArm'):
-                    rc_controls.armed = not rc_controls.armed
-                if data.get('cycleMode'):
-                    rc_controls.flight_mode = (rc_controls.flight_mode + 1) % 3
+                apply_control_input(session, data)
 
-                # Optional push to phone if reachable
-                if phone_addr:
-                    send_rc_controls_to_phone()
+                # Wake streams and push to phone if reachable
+                controls_changed(session, received)
 
                 self.wfile.write(json.dumps({'status': 'ok'}).encode())
             except Exception as e:
+                metrics.count_error('bad_control')
                 self.wfile.write(json.dumps({'status': 'error', 'message': str(e)}).encode())
             
         elif path == '/api/arm':
@@ -325,11 +2026,10 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
             self.send_header('Content-type', 'application/json')
             self.end_headers()
             
-            rc_controls.armed = not rc_controls.armed
-            if phone_addr:
-                send_rc_controls_to_phone()
+            frame = session.controls.apply(toggle_arm=True)
+            controls_changed(session)
                 
-            self.wfile.write(json.dumps({'status': 'ok', 'armed': rc_controls.armed}).encode())
+            self.wfile.write(json.dumps({'status': 'ok', 'armed': frame.armed}).encode())
             
         elif path == '/api/flightmode':
             # API endpoint for flight mode
@@ -337,62 +2037,132 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
             self.send_header('Content-type', 'application/json')
             self.end_headers()
             
-            rc_controls.flight_mode = (rc_controls.flight_mode + 1) % 3
-            if phone_addr:
-                send_rc_controls_to_phone()
+            frame = session.controls.apply(cycle_mode=True)
+            controls_changed(session)
                 
-            self.wfile.write(json.dumps({'status': 'ok', 'flight_mode': rc_controls.flight_mode}).encode())
+            self.wfile.write(json.dumps({'status': 'ok', 'flight_mode': frame.flight_mode}).encode())
             
         elif path == '/api/command':
-            # API endpoint for custom commands
+            # Queue a custom command for the relay: {"command": ...} -> its ID;
+            # ?id=<id> reports whether it is pending, delivered or expired
+            query = urllib.parse.parse_qs(parsed_path.query)
+            if 'id' in query:
+                try:
+                    command_id = parse_command_ref(query['id'][0])
+                except ValueError:
+                    self.send_error(400, 'id must be a command id from this server')
+                    return
+                state = session.commands.state(command_id) if command_id is not None else None
+                if state is None:
+                    self.send_error(404, 'Unknown or forgotten command id')
+                    return
+                reply = {'status': 'ok', 'id': command_ref(command_id), 'state': state}
+            else:
+                try:
+                    content_length = int(self.headers.get('Content-Length', 0))
+                    command = json.loads(self.rfile.read(content_length).decode())['command']
+                except (ValueError, KeyError, TypeError):
+                    self.send_error(400, 'Expected {"command": ...}')
+                    return
+                command_id = session.queue_command(command)
+                if command_id is None:
+                    self.send_shed(503, 1, 'Command queue full, relay is not acknowledging')
+                    return
+                reply = {'status': 'ok', 'id': command_ref(command_id), 'state': 'pending'}
+
+            body = json.dumps(reply).encode()
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode())
-            
-            if phone_addr:
-                send_command_to_phone(data['command'])
-                
-            self.wfile.write(json.dumps({'status': 'ok'}).encode())
+            self.wfile.write(body)
             
         elif path == '/phone/keepalive':
-            # Phone keep-alive endpoint
-            global phone_addr, phone_last_seen, is_connected
+            # Phone keep-alive endpoint; ?ack=<ids> acknowledges forwarded commands
+            try:
+                acks = parse_acks(urllib.parse.parse_qs(parsed_path.query))
+            except ValueError:
+                self.send_error(400, 'ack must be comma-separated command ids')
+                return
+            if acks:
+                session.acknowledge_commands(acks)
             phone_addr = (self.client_address[0], self.client_address[1])
-            phone_last_seen = time.time()
-            
-            if not is_connected:
-                print(f"✓ Phone connected from {phone_addr[0]}:{phone_addr[1]}")
-                is_connected = True
+            if not session.phone_seen(phone_addr):
+                print(f"✓ Phone connected from {phone_addr[0]}:{phone_addr[1]} ({session.vehicle_id})")
+                viewer_broadcaster.publish(session)
             else:
-                print(f"✓ Phone keep-alive from {phone_addr[0]}:{phone_addr[1]}")
+                print(f"✓ Phone keep-alive from {phone_addr[0]}:{phone_addr[1]} ({session.vehicle_id})")
             
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
             self.wfile.write(json.dumps({'status': 'ok'}).encode())
             
-        elif path == '/api/get_controls':
-            # ESP32/phone pull endpoint
+        elif path == '/phone/frame_ack':
+            # Relay timing report: {"version": v, "received_at": ms, "forwarded_at": ms} (epoch ms)
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+                data = json.loads(self.rfile.read(content_length).decode())
+                version = int(data['version'])
+                received_at = float(data['received_at']) / 1000.0
+            except (ValueError, KeyError, TypeError):
+                self.send_error(400, 'Expected version and received_at')
+                return
+            updated_at = session.frame_time(version)
+            if updated_at is not None:
+                metrics.observe('server_to_relay', received_at - updated_at)
+            if isinstance(data.get('forwarded_at'), (int, float)):
+                metrics.observe('relay_forward', data['forwarded_at'] / 1000.0 - received_at)
+
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
+            self.wfile.write(json.dumps({'status': 'ok'}).encode())
+
+        elif path == '/api/get_controls':
+            # ESP32/phone pull endpoint; ?since=<version>&wait=<s> turns it into a long-poll,
+            # ?ack=<ids> acknowledges commands forwarded from an earlier response
+            self.handle_get_controls(session, urllib.parse.parse_qs(parsed_path.query))
+
+        elif path == '/ws/controls':
+            # WebSocket input channel for the browser gamepad and sliders
+            self.handle_control_socket(session)
+
+        elif path == '/api/stream_controls':
+            # Server-sent events: one frame per change plus heartbeats
+            self.handle_stream_controls(session)
+
+        elif path == '/api/watch':
+            # Dashboard live status: server-sent events fanned out by the viewer broadcaster
+            self.handle_watch(session)
+
+        elif path == '/api/telemetry':
+            # Telemetry history: ?since=<cursor>&fields=a,b&bucket=<seconds>
+            query = urllib.parse.parse_qs(parsed_path.query)
+            try:
+                since = int(query['since'][0]) if 'since' in query else None
+                fields = query['fields'][0].split(',') if 'fields' in query else None
+                bucket = float(query['bucket'][0]) if 'bucket' in query else None
+            except ValueError:
+                self.send_error(400, 'since must be an integer and bucket a number of seconds')
+                return
+            if bucket is not None and not (math.isfinite(bucket) and bucket > 0):
+                self.send_error(400, 'bucket must be a positive number of seconds')
+                return
 
-            self.wfile.write(rc_controls.to_json().encode())
+            body = json.dumps(session.telemetry.query(since, fields, bucket)).encode()
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
         elif path == '/phone/telemetry':
             # Phone telemetry endpoint
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length > 0:
                 post_data = self.rfile.read(content_length)
-                try:
-                    telemetry = json.loads(post_data.decode())
-                    print(f"📊 Telemetry: {telemetry}")
-                except:
-                    print(f"📨 Raw telemetry: {post_data.decode()}")
+                ingest_telemetry(session, post_data, self.client_address[0])
             
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
@@ -400,53 +2170,838 @@ class RCHTTPHandler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({'status': 'ok'}).encode())
             
         else:
+            self.route = 'other'
             self.send_response(404)
             self.end_headers()
             self.wfile.write(b'Not found')
 
-def send_rc_controls_to_phone():
-    """Send RC controls to phone via HTTP"""
-    global phone_addr, rc_controls
-    
-    if not phone_addr:
-        return
-        
-    try:
-        import urllib.request
-        import urllib.parse
-        
-        rc_json = rc_controls.to_json()
-        data = urllib.parse.urlencode({'rc_controls': rc_json}).encode()
-        
-        req = urllib.request.Request(f'http://{phone_addr[0]}:8080/rc_controls', data=data)
-        urllib.request.urlopen(req, timeout=5)
-        print(f"🎮 RC: T={rc_controls.throttle:.2f} A={rc_controls.aileron:.2f} E={rc_controls.elevator:.2f} R={rc_controls.rudder:.2f} {'ARMED' if rc_controls.armed else 'DISARMED'}")
-    except Exception as e:
-        print(f"Error sending RC controls: {e}")
+    def log_request(self, code='-', size='-'):
+        # Every response passes through here, including send_error()
+        if isinstance(code, int):
+            metrics.count_request(getattr(self, 'route', 'other'), int(code))
+        super().log_request(code, size)
 
-def send_command_to_phone(command):
-    """Send custom command to phone via HTTP"""
-    global phone_addr
-    
-    if not phone_addr:
+    def handle_get_controls(self, session, query):
+        try:
+            acks = parse_acks(query)
+        except ValueError:
+            self.send_error(400, 'ack must be comma-separated command ids')
+            return
+        if acks:
+            session.acknowledge_commands(acks)
+
+        binary = wants_binary_frame(self.headers.get('Accept', ''), query)
+        # Taken with the snapshot so a command queued from here on also ends the wait (JSON carries them)
+        last_command = None if binary else session.commands.last_id
+        frame = session.controls.snapshot
+        if 'since' in query:
+            try:
+                since = int(query['since'][0])
+                wait = min(float(query.get('wait', [LONG_POLL_MAX_WAIT])[0]), LONG_POLL_MAX_WAIT)
+            except ValueError:
+                self.send_error(400, 'since and wait must be numbers')
+                return
+            if since == frame.version and wait > 0:
+                if getattr(self.server, 'concurrent', False) and long_poll_slots.acquire(blocking=False):
+                    try:
+                        frame = session.feed.wait_for_change(since, wait, last_command)
+                    finally:
+                        long_poll_slots.release()
+                    if frame.version != since:
+                        metrics.observe('publish_to_fetch', time.time() - frame.updated_at)
+                else:
+                    # Every waiting slot is taken: answer now and let the client poll again
+                    metrics.count_error('long_poll_full')
+
+        if binary:
+            # Fixed-size frames have no room for commands; binary readers fetch them as JSON
+            body = frame.encode('binary')
+            etag = f'"{BOOT_ID}-c{frame.version}b"'
+            content_type = FRAME_CONTENT_TYPE
+        else:
+            revision, commands = session.commands.encode()
+            body = with_commands(frame.encode('json'), commands)
+            etag = f'"{BOOT_ID}-c{frame.version}' + (f'q{revision}"' if commands else '"')
+            content_type = 'application/json'
+        self.send_cacheable(body, content_type, etag, {'X-RC-Version': str(frame.version)})
+
+    def send_page(self):
+        gzipped = accepts_gzip(self.headers.get('Accept-Encoding'))
+        # Each encoding is its own representation, so it gets its own strong ETag
+        etag = CONTROL_PAGE_ETAG[:-1] + '-gz"' if gzipped else CONTROL_PAGE_ETAG
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            body = b''
+        else:
+            body = CONTROL_PAGE_GZIP if gzipped else CONTROL_PAGE_BODY
+            self.send_response(200)
+            self.send_header('Content-type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def send_cacheable(self, body, content_type, etag, extra_headers=None):
+        """Send body with a strong ETag, or a bodyless 304 if the client already has it"""
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            body = b''
+        else:
+            self.send_response(200)
+            self.send_header('Content-type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def handle_control_socket(self, session):
+        if self.headers.get('Upgrade', '').lower() != 'websocket' or 'Sec-WebSocket-Key' not in self.headers:
+            self.send_error(400, 'Expected a WebSocket upgrade')
+            return
+        if not getattr(self.server, 'concurrent', False) or not control_socket_slots.acquire(blocking=False):
+            self.send_error(503, 'No socket slots available, POST to /api/controls instead')
+            return
+
+        try:
+            # The upgrade response must be HTTP/1.1
+            self.protocol_version = 'HTTP/1.1'
+            self.send_response(101, 'Switching Protocols')
+            self.send_header('Upgrade', 'websocket')
+            self.send_header('Connection', 'Upgrade')
+            self.send_header('Sec-WebSocket-Accept', ws_accept_key(self.headers['Sec-WebSocket-Key']))
+            self.end_headers()
+
+            last_seq = -1
+            dropped = 0
+            while True:
+                opcode, payload = ws_read_message(self.rfile)
+                if opcode == WS_OP_CLOSE:
+                    ws_send_frame(self.wfile, WS_OP_CLOSE, payload[:2])
+                    break
+                if opcode == WS_OP_PING:
+                    ws_send_frame(self.wfile, WS_OP_PONG, payload)
+                    continue
+                if opcode != WS_OP_TEXT:
+                    continue
+
+                received = time.perf_counter()
+                frame = json.loads(payload.decode())
+                if not isinstance(frame, dict):
+                    raise ValueError('control frames must be JSON objects')
+                seq = frame.get('seq')
+                if seq is None:
+                    # Idle keep-alive from the page; keeps the socket open but carries no
+                    # stick values, so it does not hold off the failsafe
+                    continue
+                if seq <= last_seq:
+                    # Overtaken by a newer frame; applying it would move the sticks backwards
+                    dropped += 1
+                    continue
+                last_seq = seq
+                observe_origin(frame)
+
+                if 'control' in frame:
+                    apply_single_control(session, frame['control'], frame['value'])
+                else:
+                    apply_control_input(session, frame)
+                controls_changed(session, received)
+        except WebSocketError as e:
+            try:
+                ws_send_frame(self.wfile, WS_OP_CLOSE, struct.pack('!H', 1002) + str(e).encode()[:100])
+            except OSError:
+                pass
+        except (ValueError, KeyError, TypeError) as e:
+            metrics.count_error('bad_control')
+            try:
+                ws_send_frame(self.wfile, WS_OP_CLOSE, struct.pack('!H', 1007) + str(e).encode()[:100])
+            except OSError:
+                pass
+        except (OSError, EOFError):
+            # Browser went away or idled past the socket timeout; the page reconnects
+            pass
+        finally:
+            if dropped:
+                print(f"🔀 Dropped {dropped} out-of-order control frame(s) from {self.client_address[0]}")
+            self.close_connection = True
+            control_socket_slots.release()
+
+    def handle_watch(self, session):
+        if not getattr(self.server, 'detachable', False) or not viewer_broadcaster.reserve():
+            self.send_error(503, 'No viewer slots available, poll /api/status instead')
+            return
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Accel-Buffering', 'no')
+            self.end_headers()
+            self.wfile.flush()
+        except OSError:
+            viewer_broadcaster.release()
+            raise
+        # From here on the broadcaster owns the socket
+        self.close_connection = True
+        self.server.detach(self.connection)
+        viewer_broadcaster.add(session, self.connection)
+
+    def handle_stream_controls(self, session):
+        if not getattr(self.server, 'concurrent', False) or not stream_slots.acquire(blocking=False):
+            # A held-open stream would starve other clients
+            self.send_error(503, 'No stream slots available, poll /api/get_controls instead')
+            return
+
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Accel-Buffering', 'no')
+            self.end_headers()
+
+            # Every message carries the commands still waiting for an ack, and a newly
+            # queued command sends one even if the controls have not moved
+            frame = session.controls.snapshot
+            last_command = session.commands.last_id
+            revision, commands = session.commands.encode()
+            # Event ids carry the boot id, since versions restart at 0 with the process
+            last_sent = self.headers.get('Last-Event-ID')
+            if last_sent != f'{BOOT_ID}-{frame.version}' or commands:
+                self.wfile.write(b'id: %s-%d\ndata: %s\n\n' % (BOOT_ID.encode(), frame.version, with_commands(frame.encode('json'), commands)))
+            while True:
+                latest = session.feed.wait_for_change(frame.version, STREAM_HEARTBEAT, last_command)
+                queued = session.commands.last_id != last_command
+                if latest.version == frame.version and not queued:
+                    self.wfile.write(b': heartbeat\n\n')
+                    continue
+                last_command = session.commands.last_id
+                revision, commands = session.commands.encode()
+                self.wfile.write(b'id: %s-%d\ndata: %s\n\n' % (BOOT_ID.encode(), latest.version, with_commands(latest.encode('json'), commands)))
+                if latest.version != frame.version:
+                    metrics.observe('publish_to_fetch', time.time() - latest.updated_at)
+                frame = latest
+        except (BrokenPipeError, ConnectionResetError, socket.timeout):
+            # Relay went away; it reconnects with Last-Event-ID
+            pass
+        finally:
+            self.close_connection = True
+            stream_slots.release()
+
+class DetachableServerMixin:
+    """Lets a handler give its connection to another owner instead of having it closed after the request"""
+    detachable = True
+
+    def detach(self, request):
+        with self.detach_lock:
+            self.detached.add(request)
+
+    def shutdown_request(self, request):
+        with self.detach_lock:
+            if request in self.detached:
+                self.detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+class BoundedThreadingHTTPServer(DetachableServerMixin, socketserver.ThreadingMixIn, HTTPServer):
+    """Thread-per-request server with a cap on concurrent requests"""
+    concurrent = True
+    daemon_threads = True
+    block_on_close = False
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.detach_lock = threading.Lock()
+        self.detached = set()
+
+    def process_request(self, request, client_address):
+        # Once max_workers requests are in flight the accept loop waits here,
+        # leaving further connections in the listen backlog
+        self.slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+class WorkerPoolHTTPServer(DetachableServerMixin, HTTPServer):
+    """Server that hands accepted connections to a fixed pool of worker threads
+
+    Workers are daemon threads, like BoundedThreadingHTTPServer's, so a
+    stream or control socket held open by a client never keeps the process
+    alive after SIGINT or SIGTERM.
+    """
+    concurrent = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.detach_lock = threading.Lock()
+        self.detached = set()
+        self.requests = queue.SimpleQueue()     # (request, client_address), None stops a worker
+        self.workers = [
+            threading.Thread(target=self.worker, name=f'rc-worker-{i}', daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        # Never queue more connections than there are idle workers
+        self.slots.acquire()
+        self.requests.put((request, client_address))
+
+    def worker(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        for _ in self.workers:
+            self.requests.put(None)
+
+SERVER_CLASSES = {
+    'single': HTTPServer,
+    'threaded': BoundedThreadingHTTPServer,
+    'pool': WorkerPoolHTTPServer,
+}
+
+def check_worker_budget(max_workers):
+    """Refuse budgets that let held-open and bulk work take the workers CONTROL_RESERVE keeps for control writes"""
+    budgets = {
+        'RC_MAX_STREAMS': MAX_STREAMS,
+        'RC_MAX_CONTROL_SOCKETS': MAX_CONTROL_SOCKETS,
+        'RC_MAX_LONG_POLLS': MAX_LONG_POLLS,
+        'RC_BULK_SLOTS': BULK_SLOTS,
+        'RC_BULK_QUEUE': BULK_QUEUE,
+    }
+    held = sum(budgets.values())
+    if CONTROL_RESERVE < 1 or held + CONTROL_RESERVE > max_workers:
+        detail = ' + '.join(f'{name}={value}' for name, value in budgets.items())
+        raise ValueError(
+            f"Worker budgets {detail} = {held} leave {max_workers - held} of {max_workers} workers "
+            f"for control requests; RC_CONTROL_RESERVE needs {max(CONTROL_RESERVE, 1)}"
+        )
+
+def make_server(address, mode=SERVER_MODE, max_workers=MAX_WORKERS):
+    """Create the HTTP server for the selected worker model"""
+    if mode not in SERVER_CLASSES:
+        raise ValueError(f"Unknown server mode '{mode}' (expected one of: {', '.join(SERVER_CLASSES)})")
+    if mode == 'single':
+        return HTTPServer(address, RCHTTPHandler)
+    check_worker_budget(max_workers)
+    return SERVER_CLASSES[mode](address, RCHTTPHandler, max_workers=max_workers)
+
+class PhoneSender:
+    """Background pipeline for phone pushes: the latest control frame wins
+
+    Commands do not go this way; they ride along with the control messages
+    the relay fetches and wait in the vehicle's CommandQueue until acked.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.cond = threading.Condition()
+        self.pending_controls = None    # (addr, rc_json, summary, queued) of the newest unsent frame
+        self.dropped_frames = 0
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        with self.cond:
+            if self.thread is None and not self.stopped:
+                self.thread = threading.Thread(target=self.run, name=f'phone-sender-{self.name}', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        """Let the sender thread finish; anything still queued is dropped"""
+        with self.cond:
+            self.stopped = True
+            self.pending_controls = None
+            self.cond.notify()
+
+    def submit_controls(self, addr, rc_json, summary):
+        # Sessions only get a sender thread once their phone has something to receive
+        if self.thread is None:
+            self.start()
+        with self.cond:
+            if self.stopped:
+                return
+            if self.pending_controls is not None:
+                # Superseded before it went out; the phone only needs the newest state
+                self.dropped_frames += 1
+            self.pending_controls = (addr, rc_json, summary, time.perf_counter())
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending_controls is None and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                addr, rc_json, summary, queued = self.pending_controls
+                self.pending_controls = None
+
+            started = time.perf_counter()
+            metrics.observe('queue_to_push', started - queued)
+            try:
+                post_to_phone(addr, '/rc_controls', {'rc_controls': rc_json})
+                metrics.observe('phone_push', time.perf_counter() - started)
+                if summary:
+                    print(f"🎮 RC: {summary}")
+            except Exception as e:
+                metrics.count_error('phone_push')
+                print(f"Error sending RC controls: {e}")
+
+class PooledConnection:
+    """Keep-alive HTTP connection to one phone plus its health counters"""
+
+    def __init__(self, host, port, timeout):
+        self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.requests = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.last_latency_ms = None
+        self.last_error = None
+        self.created = time.time()
+
+    def post(self, route, body, headers):
+        # http.client reopens a closed socket on the next request
+        reused = self.conn.sock is not None
+        if not reused and self.requests:
+            self.reconnects += 1
+        started = time.perf_counter()
+        try:
+            self.conn.request('POST', route, body, headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            self.conn.close()
+            self.failures += 1
+            self.last_error = str(e)
+            raise
+        finally:
+            self.requests += 1
+        self.last_latency_ms = (time.perf_counter() - started) * 1000.0
+        if response.will_close:
+            self.conn.close()
+        return response.status, data
+
+    def close(self):
+        self.conn.close()
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'reconnects': self.reconnects,
+            'open': self.conn.sock is not None,
+            'last_latency_ms': self.last_latency_ms,
+            'last_error': self.last_error,
+            'age_s': round(time.time() - self.created, 1),
+        }
+
+class PhoneConnectionPool:
+    """Keep-alive connections to phones, keyed by (host, port)"""
+
+    def __init__(self, timeout=PHONE_PUSH_TIMEOUT, max_idle_per_host=2):
+        self.lock = threading.Lock()
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.idle = {}          # key -> [PooledConnection] ready for reuse
+        self.connections = {}   # key -> [PooledConnection] every live connection
+        self.generation = 0     # bumped whenever the stats change
+
+    def acquire(self, key):
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop()
+            pooled = PooledConnection(key[0], key[1], self.timeout)
+            self.connections.setdefault(key, []).append(pooled)
+            return pooled
+
+    def release(self, key, pooled):
+        with self.lock:
+            self.generation += 1
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(pooled)
+                return
+            self.connections[key].remove(pooled)
+        pooled.close()
+
+    def post(self, key, route, body, headers):
+        """POST through a pooled connection, retrying once if a reused socket had gone stale"""
+        pooled = self.acquire(key)
+        try:
+            reused = pooled.conn.sock is not None
+            try:
+                return pooled.post(route, body, headers)
+            except (http.client.HTTPException, OSError):
+                if not reused:
+                    raise
+                return pooled.post(route, body, headers)
+        finally:
+            self.release(key, pooled)
+
+    def close_host(self, key):
+        """Drop every connection to a phone that went away"""
+        with self.lock:
+            self.generation += 1
+            pooled_list = self.connections.pop(key, [])
+            self.idle.pop(key, None)
+        for pooled in pooled_list:
+            pooled.close()
+
+    def stats(self, host=None):
+        """Per-connection health, for every phone or only the one at `host`"""
+        with self.lock:
+            return {
+                f'{key[0]}:{key[1]}': [pooled.stats() for pooled in pooled_list]
+                for key, pooled_list in self.connections.items()
+                if host is None or key[0] == host
+            }
+
+phone_pool = PhoneConnectionPool()
+
+def post_to_phone(addr, route, fields):
+    """POST form fields to the phone's local HTTP server"""
+    body = urllib.parse.urlencode(fields).encode()
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    status, _ = phone_pool.post((addr[0], PHONE_HTTP_PORT), route, body, headers)
+    if status >= 400:
+        raise RuntimeError(f'phone answered HTTP {status} for {route}')
+
+def send_rc_controls_to_phone(session):
+    """Queue a vehicle's current RC controls for delivery to its phone"""
+    addr = session.phone_addr
+    if not addr:
         return
-        
-    try:
-        import urllib.request
-        import urllib.parse
-        
-        data = urllib.parse.urlencode({'command': command}).encode()
-        
-        req = urllib.request.Request(f'http://{phone_addr[0]}:8080/command', data=data)
-        urllib.request.urlopen(req, timeout=5)
-        print(f"✓ Sent command: {command}")
-    except Exception as e:
-        print(f"Error sending command: {e}")
 
-def main():
+    frame = session.controls.snapshot
+    # The flight log keeps every frame; only narrate pushes on stdout without it
+    summary = None if session.flight_log is not None else f"{session.vehicle_id} T={frame.throttle:.2f} A={frame.aileron:.2f} E={frame.elevator:.2f} R={frame.rudder:.2f} {'ARMED' if frame.armed else 'DISARMED'}"
+    session.sender.submit_controls(addr, frame.encode('json'), summary)
+
+class ControlUDPEndpoint:
+    """UDP ingress and egress for control frames
+
+    Binary control frames from any sender are applied like a gamepad frame.
+    A hello frame, or the legacy relay's 'PHONE_ALIVE', subscribes the sender
+    to every control change; binary frames by default, JSON for legacy relays
+    or hellos carrying FRAME_FLAG_JSON. A vehicle ID after the hello header
+    (or after 'PHONE_ALIVE ') picks the session, otherwise it is the default
+    vehicle. JSON datagrams coming back are telemetry forwarded from the ESP32.
+    """
+
+    def __init__(self, port, subscriber_ttl, sender_ttl=UDP_SENDER_TTL, max_senders=MAX_UDP_SENDERS):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('0.0.0.0', port))
+        self.port = port
+        self.subscriber_ttl = subscriber_ttl
+        self.sender_ttl = sender_ttl
+        self.max_senders = max_senders
+        self.lock = threading.Lock()
+        self.subscribers = {}       # vehicle_id -> {addr: encoding}, expired by the deadline scheduler
+        self.vehicles = {}          # addr -> vehicle_id it subscribed to
+        self.last_seq = {}          # addr -> (seq, t_ms) of its last applied frame, forgotten after sender_ttl
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='udp-controls', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+                self.handle_datagram(data, addr)
+            except (ValueError, struct.error) as e:
+                metrics.count_error('bad_datagram')
+                print(f"Bad UDP datagram: {e}")
+            except OSError as e:
+                print(f"UDP endpoint error: {e}")
+                time.sleep(0.1)
+            except Exception as e:
+                # Whatever one datagram does, the endpoint keeps serving the rest
+                metrics.count_error('bad_datagram')
+                print(f"Error handling UDP datagram: {e!r}")
+
+    def handle_datagram(self, data, addr):
+        if data[:1] == bytes([FRAME_MAGIC]):
+            if len(data) < FRAME_HEADER.size:
+                raise ValueError(f'frame header needs {FRAME_HEADER.size} bytes, got {len(data)}')
+            magic, version, frame_type, flags = FRAME_HEADER.unpack_from(data)
+            if frame_type == FRAME_TYPE_HELLO:
+                vehicle_id = data[FRAME_HEADER.size:].decode('ascii').strip() or DEFAULT_VEHICLE
+                self.subscribe(addr, vehicle_id, 'json' if flags & FRAME_FLAG_JSON else 'binary')
+                return
+            received = time.perf_counter()
+            frame = decode_control_frame(data)
+            if not self.accept_seq(addr, frame['seq'], frame['t_ms']):
+                return
+            session = self.session_for(addr, create=True)
+            session.input_seen()
+            session.apply_input({axis: frame[axis] for axis in SHAPED_AXES}, armed=frame['armed'], flight_mode=frame['flight_mode'])
+            controls_changed(session, received)
+        elif data.startswith(b'PHONE_ALIVE'):
+            # Legacy UDP relay forwards our datagrams verbatim to an ESP32 that parses JSON
+            vehicle_id = data[len(b'PHONE_ALIVE'):].decode('ascii').strip() or DEFAULT_VEHICLE
+            self.subscribe(addr, vehicle_id, 'json')
+        else:
+            ingest_telemetry(self.session_for(addr), data, addr[0])
+
+    def accept_seq(self, addr, seq, t_ms):
+        """Record a control frame's seq; False for a late or duplicate frame that must be dropped
+
+        An older seq is still taken when the sender's clock went back by more
+        than UDP_RESTART_GAP_MS too: it rebooted and restarted its sequence
+        from the same addr:port. A sender quiet for `sender_ttl` is forgotten,
+        so after an idle gap any seq is taken as well.
+        """
+        with self.lock:
+            last = self.last_seq.get(addr)
+            if last is None:
+                if len(self.last_seq) >= self.max_senders:
+                    raise ValueError(f'already tracking {self.max_senders} UDP senders')
+            elif not seq_is_newer(seq, last[0]):
+                clock_back = (last[1] - t_ms) & 0xFFFFFFFF
+                if not UDP_RESTART_GAP_MS < clock_back < 0x80000000:
+                    return False
+                print(f"UDP sender {addr[0]}:{addr[1]} restarted its sequence")
+            self.last_seq[addr] = (seq, t_ms)
+        deadlines.arm(('udp-sender', addr), self.sender_ttl, self.forget_sender, addr)
+        return True
+
+    def forget_sender(self, addr):
+        """Deadline callback: a sender went `sender_ttl` without a control frame"""
+        with self.lock:
+            self.last_seq.pop(addr, None)
+
+    def session_for(self, addr, create=False):
+        """Session a datagram from addr belongs to: the vehicle it subscribed to, else the default one"""
+        vehicle_id = self.vehicles.get(addr, DEFAULT_VEHICLE)
+        session = sessions.open(vehicle_id) if create else sessions.get(vehicle_id)
+        if session is None:
+            raise ValueError(f'no session slot for vehicle {vehicle_id!r}')
+        return session
+
+    def subscribe(self, addr, vehicle_id, encoding):
+        session = sessions.open(vehicle_id)
+        if session is None:
+            raise ValueError(f'no session slot for vehicle {vehicle_id!r}')
+        with self.lock:
+            previous = self.vehicles.get(addr)
+            if previous is not None and previous != vehicle_id:
+                self.subscribers[previous].pop(addr, None)
+            if previous != vehicle_id:
+                print(f"✓ UDP subscriber {addr[0]}:{addr[1]} ({vehicle_id}, {encoding})")
+            self.vehicles[addr] = vehicle_id
+            self.subscribers.setdefault(vehicle_id, {})[addr] = encoding
+            # A hello starts a new run of control frames, so whatever seq it counts from is taken
+            self.last_seq.pop(addr, None)
+        deadlines.arm(('udp', addr), self.subscriber_ttl, self.expire, addr)
+        self.send_to(addr, session, encoding)
+
+    def expire(self, addr):
+        """Deadline callback: a subscriber went `subscriber_ttl` without a fresh hello"""
+        with self.lock:
+            vehicle_id = self.vehicles.pop(addr, None)
+            if vehicle_id is None:
+                return
+            self.subscribers[vehicle_id].pop(addr, None)
+        print(f"UDP subscriber {addr[0]}:{addr[1]} expired")
+
+    def send_to(self, addr, session, encoding):
+        self.sock.sendto(session.controls.encode(encoding), addr)
+
+    def broadcast(self, session):
+        """Send a vehicle's controls to its live subscribers, encoding each format once"""
+        with self.lock:
+            subscribers = self.subscribers.get(session.vehicle_id)
+            if not subscribers:
+                return
+            targets = list(subscribers.items())
+        frame = session.controls.snapshot
+        for addr, encoding in targets:
+            try:
+                self.sock.sendto(frame.encode(encoding), addr)
+            except OSError as e:
+                print(f"UDP send to {addr[0]}:{addr[1]} failed: {e}")
+
+    def subscriber_count(self, vehicle_id):
+        with self.lock:
+            return len(self.subscribers.get(vehicle_id, ()))
+
+udp_endpoint = None
+
+# Flight log segment layout: SEGMENT_MAGIC, then records of RECORD_HEADER + payload.
+# The unused tail of a preallocated segment is zero-filled, which reads as RECORD_END.
+SEGMENT_MAGIC = b'RCLOG\x00\x01\x00'
+RECORD_HEADER = struct.Struct('<BId')       # type u8, payload length u32, wall time f64
+RECORD_END = 0
+RECORD_CONTROLS = 1                         # payload: binary control frame
+RECORD_TELEMETRY = 2                        # payload: telemetry JSON as received
+INDEX_ENTRY = struct.Struct('<dQ')          # wall time, record offset
+
+class FlightLog:
+    """Append-only flight recorder writing memory-mapped segment files
+
+    Each segment is preallocated and mapped once, so appending a record is a
+    memory copy. A sparse index of (time, offset) pairs, one every
+    `index_interval` seconds, goes to a sidecar .idx file for seeking.
+    """
+
+    def __init__(self, directory, segment_bytes, index_interval=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.lock = threading.Lock()
+        self.segment_number = 0
+        self.file = None
+        self.map = None
+        self.index_file = None
+        self.path = None
+        self.records = 0
+        self.open_segment()
+
+    def open_segment(self):
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.segment_number += 1
+        self.path = os.path.join(self.directory, f'flight-{stamp}-{self.segment_number:03d}.rclog')
+        self.file = open(self.path, 'w+b')
+        self.file.truncate(self.segment_bytes)
+        self.map = mmap.mmap(self.file.fileno(), self.segment_bytes)
+        self.map[:len(SEGMENT_MAGIC)] = SEGMENT_MAGIC
+        self.offset = len(SEGMENT_MAGIC)
+        self.index_file = open(self.path + '.idx', 'wb')
+        self.last_indexed = None
+        print(f"📼 Flight log segment {self.path}")
+
+    def close_segment(self):
+        # Trim the unused preallocated tail so finished segments stay compact
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(self.offset)
+        self.file.close()
+        self.index_file.close()
+
+    def append(self, record_type, payload, t=None):
+        t = time.time() if t is None else t
+        size = RECORD_HEADER.size + len(payload)
+        with self.lock:
+            if self.map is None:
+                return
+            if self.offset + size > self.segment_bytes:
+                if size + len(SEGMENT_MAGIC) > self.segment_bytes:
+                    return
+                self.close_segment()
+                self.open_segment()
+            if self.last_indexed is None or t - self.last_indexed >= self.index_interval:
+                self.index_file.write(INDEX_ENTRY.pack(t, self.offset))
+                self.index_file.flush()
+                self.last_indexed = t
+            end = self.offset + size
+            self.map[self.offset:end] = RECORD_HEADER.pack(record_type, len(payload), t) + payload
+            self.offset = end
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.close_segment()
+                self.map = None
+
+def read_flight_log(path, start_time=None):
+    """Yield (record_type, t, payload) from a segment, using its index to skip ahead to start_time"""
+    offset = len(SEGMENT_MAGIC)
+    if start_time is not None and os.path.exists(path + '.idx'):
+        with open(path + '.idx', 'rb') as f:
+            entries = [entry for entry in INDEX_ENTRY.iter_unpack(f.read())]
+        position = bisect.bisect_right([t for t, _ in entries], start_time) - 1
+        if position >= 0:
+            offset = entries[position][1]
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f'{path} is not a flight log segment')
+        while offset + RECORD_HEADER.size <= len(data):
+            record_type, length, t = RECORD_HEADER.unpack_from(data, offset)
+            if record_type == RECORD_END:
+                break
+            offset += RECORD_HEADER.size
+            payload = data[offset:offset + length]
+            offset += length
+            if start_time is None or t >= start_time:
+                yield record_type, t, payload
+
+def replay_flight_log(session, path, speed=1.0, start=0.0, loop=False):
+    """Feed a recorded flight back through a vehicle's controls pipeline at `speed` times real time"""
+    while True:
+        first = next(read_flight_log(path), None)
+        if first is None:
+            print(f"⚠️  {path} has no records")
+            return
+        origin = first[1] + start
+        started = time.monotonic()
+        frames = 0
+        for record_type, t, payload in read_flight_log(path, origin if start else None):
+            delay = (t - origin) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+            if record_type == RECORD_CONTROLS:
+                frame = decode_control_frame(payload)
+                session.controls.apply(**{name: frame[name] for name in CONTROL_FIELDS})
+                controls_changed(session)
+                frames += 1
+            elif record_type == RECORD_TELEMETRY:
+                ingest_telemetry(session, payload)
+        print(f"📼 Replayed {frames} control frames from {path}")
+        if not loop:
+            return
+
+def main(argv=None):
+    global udp_endpoint, flight_log_dir
+
+    parser = argparse.ArgumentParser(description='Web-based RC plane control server')
+    parser.add_argument('--replay', metavar='SEGMENT', help='replay a recorded .rclog segment instead of recording')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed multiplier (default: real time)')
+    parser.add_argument('--from', dest='start', type=float, default=0.0, help='seconds into the recording to start from')
+    parser.add_argument('--loop', action='store_true', help='restart the replay when it reaches the end')
+    parser.add_argument('--vehicle', default=DEFAULT_VEHICLE, help='vehicle session the replay drives')
+    args = parser.parse_args(argv)
+
     try:
-        server = HTTPServer(('0.0.0.0', LISTEN_PORT), RCHTTPHandler)
-        print(f"✓ RC Web Server listening on 0.0.0.0:{LISTEN_PORT} (HTTP)")
+        server = make_server(('0.0.0.0', LISTEN_PORT))
+        print(f"✓ RC Web Server listening on 0.0.0.0:{LISTEN_PORT} (HTTP, {SERVER_MODE} mode, max {MAX_WORKERS} workers)")
         
         print("\n" + "="*60)
         print("WEB-BASED RC PLANE CONTROL SERVER")
@@ -461,6 +3016,33 @@ def main():
         print("  - Custom command sending")
         print("  - Telemetry display")
         print("="*60)
+
+        if args.replay:
+            threading.Thread(
+                target=replay_flight_log, args=(sessions.open(args.vehicle), args.replay, args.speed, args.start, args.loop),
+                name='replay', daemon=True,
+            ).start()
+            print(f"📼 Replaying {args.replay} into '{args.vehicle}' at {args.speed:g}x")
+        elif FLIGHT_LOG_DIR:
+            # Each vehicle session records into its own subdirectory
+            flight_log_dir = FLIGHT_LOG_DIR
+            # Render stops services with SIGTERM; unwind so the open segment gets trimmed
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        if UDP_PORT:
+            udp_endpoint = ControlUDPEndpoint(UDP_PORT, UDP_SUBSCRIBER_TTL, UDP_SENDER_TTL, MAX_UDP_SENDERS)
+            udp_endpoint.start()
+            print(f"✓ UDP control frames on 0.0.0.0:{UDP_PORT}")
+
+        deadlines.start()
+        # The default vehicle is always there for unprefixed routes; created here so it records if enabled
+        sessions.open(DEFAULT_VEHICLE)
+        print(f"✓ Input shaping: {json.dumps(shaping_profile.settings)}")
+        if FAILSAFE_TIMEOUT > 0:
+            print(f"✓ Failsafe: throttle {FAILSAFE_THROTTLE:g} after {FAILSAFE_TIMEOUT:g}s without input, phones expire after {PHONE_TIMEOUT:g}s")
+
+        if getattr(server, 'detachable', False):
+            viewer_broadcaster.start()
         
         # Start Xbox controller thread if available
         try:
@@ -473,16 +3055,110 @@ def main():
         except Exception as e:
             print(f"⚠️  Xbox controller error: {e}")
         
-        server.serve_forever()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            sessions.close()
         
     except Exception as e:
         print(f"Failed to start RC web server: {e}")
         print("Make sure port 8080 is not already in use.")
         input("Press Enter to exit...")
 
+class GamepadCoalescer:
+    """Folds gamepad events into pending state and transmits it on a fixed tick
+
+    Axis moves smaller than `deadband` against the last raw input are not
+    sent; button presses wake the tick thread for an immediate send. Sent
+    frames go through the vehicle's input shaper like any other source.
+
+    A pad held still produces no events, so liveness comes from the device
+    rather than from event traffic: every tick refreshes the failsafe
+    while the pad is attached and in use, and a read error detaches it and
+    trips the failsafe straight away.
+    """
+
+    def __init__(self, session, tick_hz, deadband):
+        self.session = session
+        self.period = 1.0 / tick_hz
+        self.deadband = deadband
+        self.lock = threading.Lock()
+        self.pending = {}           # axis -> latest unsent value
+        self.toggle_arm = False
+        self.cycle_mode = False
+        self.wake = threading.Event()
+        self.frames_sent = 0
+        self.events_folded = 0
+        self.attached = False       # pad has sent input and has not failed a read since
+
+    def axis(self, name, value):
+        self.attached = True
+        with self.lock:
+            self.pending[name] = value
+            self.events_folded += 1
+
+    def button(self, toggle_arm=False, cycle_mode=False):
+        self.attached = True
+        with self.lock:
+            # A second press before the flush cancels the first
+            self.toggle_arm ^= toggle_arm
+            self.cycle_mode ^= cycle_mode
+        self.wake.set()
+
+    def run(self):
+        next_tick = time.monotonic() + self.period
+        while True:
+            self.wake.wait(max(0.0, next_tick - time.monotonic()))
+            self.wake.clear()
+            if self.attached:
+                self.session.input_seen()
+            self.flush()
+            now = time.monotonic()
+            if now >= next_tick:
+                # Skip missed ticks rather than bursting to catch up
+                next_tick = max(next_tick + self.period, now)
+
+    def detach(self, reason):
+        """The pad failed a read or went away: stop vouching for it and cut throttle now"""
+        if not self.attached:
+            return
+        self.attached = False
+        with self.lock:
+            self.pending = {}
+        self.session.engage_failsafe(f'Gamepad lost ({reason})')
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            toggle_arm, cycle_mode = self.toggle_arm, self.cycle_mode
+            self.toggle_arm = self.cycle_mode = False
+
+        # Compare raw against raw: the frame holds shaped values
+        shaper = self.session.shaper
+        changes = {
+            axis: value for axis, value in pending.items()
+            if abs(value - shaper.raw_value(axis)) >= self.deadband
+        }
+        if not changes and not toggle_arm and not cycle_mode:
+            return
+
+        frame = self.session.apply_input(changes, toggle_arm=toggle_arm, cycle_mode=cycle_mode)
+        self.frames_sent += 1
+        if toggle_arm:
+            print(f"🔄 {'ARMED' if frame.armed else 'DISARMED'}")
+        if cycle_mode:
+            modes = ['MANUAL', 'STABILIZED', 'AUTO']
+            print(f"🔄 Flight mode: {modes[frame.flight_mode]}")
+
+        # Wake streams and send RC controls to phone
+        controls_changed(self.session)
+
+# Xbox stick axes: left Y throttle, left X rudder, right Y elevator, right X aileron
+XBOX_AXES = {'ABS_Y': 'throttle', 'ABS_X': 'rudder', 'ABS_RY': 'elevator', 'ABS_RX': 'aileron'}
+
 def xbox_controller_loop():
-    """Handle Xbox controller input"""
-    global rc_controls, phone_addr, is_connected
+    """Handle Xbox controller input for the RC_XBOX_VEHICLE session"""
     
     try:
         import inputs
@@ -494,38 +3170,35 @@ def xbox_controller_loop():
             return
             
         print(f"✓ Found {len(devices)} gamepad(s)")
+
+        session = sessions.open(XBOX_VEHICLE)
+        coalescer = GamepadCoalescer(session, XBOX_TICK_HZ, XBOX_AXIS_DEADBAND)
+        threading.Thread(target=coalescer.run, name='xbox-tick', daemon=True).start()
+        print(f"✓ Xbox input sent at up to {XBOX_TICK_HZ:g} Hz")
         
         while True:
             try:
                 events = inputs.get_gamepad()
                 for event in events:
-                    if not is_connected or not phone_addr:
+                    if not session.is_connected or not session.phone_addr:
                         continue
                         
-                    # Map Xbox controller to RC controls
-                    if event.code == 'ABS_Y':  # Left stick Y (throttle)
-                        rc_controls.throttle = (event.state + 32768) / 65536.0
-                    elif event.code == 'ABS_X':  # Left stick X (rudder)
-                        rc_controls.rudder = (event.state - 32768) / 32768.0
-                    elif event.code == 'ABS_RY':  # Right stick Y (elevator)
-                        rc_controls.elevator = (event.state - 32768) / 32768.0
-                    elif event.code == 'ABS_RX':  # Right stick X (aileron)
-                        rc_controls.aileron = (event.state - 32768) / 32768.0
+                    # Sticks report signed 16-bit states; deadzone and curves are left to the shaper
+                    axis = XBOX_AXES.get(event.code)
+                    if axis == 'throttle':
+                        coalescer.axis(axis, (event.state + 32768) / 65535.0)
+                    elif axis is not None:
+                        coalescer.axis(axis, max(event.state / 32767.0, -1.0))
                     elif event.code == 'BTN_SOUTH':  # A button (arm/disarm)
                         if event.state == 1:  # Button pressed
-                            rc_controls.armed = not rc_controls.armed
-                            print(f"🔄 {'ARMED' if rc_controls.armed else 'DISARMED'}")
+                            coalescer.button(toggle_arm=True)
                     elif event.code == 'BTN_EAST':  # B button (flight mode)
                         if event.state == 1:  # Button pressed
-                            rc_controls.flight_mode = (rc_controls.flight_mode + 1) % 3
-                            modes = ['MANUAL', 'STABILIZED', 'AUTO']
-                            print(f"🔄 Flight mode: {modes[rc_controls.flight_mode]}")
-                    
-                    # Send RC controls to phone
-                    send_rc_controls_to_phone()
+                            coalescer.button(cycle_mode=True)
                     
             except Exception as e:
                 print(f"Xbox controller error: {e}")
+                coalescer.detach(e)
                 time.sleep(0.1)
                 
     except Exception as e:
@@ -0,0 +1,82 @@
+"""Tests for the binary control-frame codec and the UDP control endpoint
+
+Run with `python -m unittest test_rc_web_server` (or pytest).
+"""
+import unittest
+
+import rc_web_server as rc
+
+
+def control_frame(seq, t_ms, throttle=0.5):
+    controls = rc.ControlFrame(throttle=throttle, aileron=-0.25, elevator=0.75, rudder=0.0, armed=True, flight_mode=1)
+    return rc.encode_control_frame(controls, seq, t_ms)
+
+
+class ControlFrameCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        frame = rc.decode_control_frame(control_frame(7, 1234))
+        self.assertEqual((frame['seq'], frame['t_ms']), (7, 1234))
+        self.assertAlmostEqual(frame['throttle'], 0.5, places=4)
+        self.assertAlmostEqual(frame['aileron'], -0.25, places=4)
+        self.assertAlmostEqual(frame['elevator'], 0.75, places=4)
+        self.assertEqual((frame['armed'], frame['flight_mode']), (True, 1))
+
+    def test_rejects_wrong_size(self):
+        with self.assertRaises(ValueError):
+            rc.decode_control_frame(control_frame(1, 0)[:-1])
+
+    def test_seq_wraps(self):
+        self.assertTrue(rc.seq_is_newer(0, 0xFFFFFFFF))
+        self.assertTrue(rc.seq_is_newer(5, 0xFFFFFFF0))
+        self.assertFalse(rc.seq_is_newer(0xFFFFFFF0, 5))
+        self.assertFalse(rc.seq_is_newer(3, 3))
+        self.assertTrue(rc.seq_is_newer(3, None))
+
+
+class ControlUDPEndpointTest(unittest.TestCase):
+    addr = ('192.0.2.1', 5000)
+
+    def setUp(self):
+        self.endpoint = rc.ControlUDPEndpoint(0, 60, sender_ttl=60, max_senders=2)
+        self.session = rc.sessions.open(rc.DEFAULT_VEHICLE)
+
+    def tearDown(self):
+        self.endpoint.sock.close()
+        for key in [('udp-sender', self.addr), ('udp-sender', ('192.0.2.2', 5000)), ('udp', self.addr)]:
+            rc.deadlines.cancel(key)
+
+    def send(self, seq, t_ms, throttle, addr=None):
+        self.endpoint.handle_datagram(control_frame(seq, t_ms, throttle), addr or self.addr)
+        return self.session.controls.snapshot.throttle
+
+    def test_drops_late_frames(self):
+        self.assertAlmostEqual(self.send(10, 1000, 0.5), 0.5, places=4)
+        self.assertAlmostEqual(self.send(9, 990, 0.2), 0.5, places=4)
+        self.assertAlmostEqual(self.send(11, 1010, 0.3), 0.3, places=4)
+
+    def test_accepts_restarted_sender(self):
+        self.send(5000, 900000, 0.5)
+        # Rebooted: seq and clock both start over from the same addr:port
+        self.assertAlmostEqual(self.send(1, 200, 0.2), 0.2, places=4)
+        self.assertAlmostEqual(self.send(2, 220, 0.3), 0.3, places=4)
+
+    def test_hello_resets_seq(self):
+        self.send(5000, 1000, 0.5)
+        self.endpoint.handle_datagram(rc.FRAME_HEADER.pack(rc.FRAME_MAGIC, rc.FRAME_VERSION, rc.FRAME_TYPE_HELLO, 0), self.addr)
+        self.assertAlmostEqual(self.send(1, 1005, 0.2), 0.2, places=4)
+
+    def test_forgets_idle_senders(self):
+        self.send(5000, 1000, 0.5)
+        self.endpoint.forget_sender(self.addr)
+        self.assertAlmostEqual(self.send(1, 1005, 0.2), 0.2, places=4)
+
+    def test_caps_tracked_senders(self):
+        self.send(1, 0, 0.5)
+        self.send(1, 0, 0.5, addr=('192.0.2.2', 5000))
+        with self.assertRaises(ValueError):
+            self.send(1, 0, 0.5, addr=('192.0.2.3', 5000))
+        self.assertEqual(len(self.endpoint.last_seq), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()